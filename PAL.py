@@ -54,12 +54,33 @@
 from pyepl import timing
 
 import codecs  # FOR READING UNICODE
+import hashlib
 import random
 import os
 import sys
 import shutil
 import unicodedata
+import numpy as np
 import playIntro
+import list_bundle
+import stim_forms
+from audio_compressor import AudioCompressor
+from batch_lists import BatchLists
+from clock_sync import ClockSync, UdpTransport
+from buffered_log import BufferedLog
+from event_pipeline import EventPipeline
+from heartbeat import Heartbeat
+from list_schedule import compile_list
+from math_bank import MathBank
+from movie_cache import MovieCache
+from recall_segmenter import RecallSegmenter
+from state_journal import StateJournal
+from stimulus_cache import StimulusCache
+from timing_audit import TimingAudit
+from update_dispatcher import UpdateDispatcher
+from vocal_onset import OnsetDetector
+from word_pool import WordPool
+from word_similarity import SimilarityIndex, ConstrainedListSampler
 
 from ramcontrol.extendedPyepl import *
 from ramcontrol.control import RAMControl, logger
@@ -100,6 +121,25 @@ class Utils:
         """
         random.seed(seed)
 
+    @staticmethod
+    def session_seed(subject, session_num):
+        """
+        Derives a platform-independent seed for a single session
+        :param subject: subject code
+        :param session_num: session number
+        :return: integer seed
+        """
+        return int(hashlib.sha1('%s_%d' % (subject, session_num)).hexdigest()[:16], 16)
+
+    @staticmethod
+    def subject_seed(subject):
+        """
+        Derives a platform-independent 32 bit seed for a subject
+        :param subject: subject code
+        :return: integer seed
+        """
+        return int(hashlib.sha1(subject).hexdigest()[:8], 16)
+
     @staticmethod
     def remove_accents(input_str):
         nkfd_form = unicodedata.normalize('NFKD', input_str)
@@ -122,7 +162,38 @@ class PALExperiment:
         self.experiment_name = config.experiment
         self.video = video
         self.clock = clock
-        self.wp = CustomTextPool(self.config.wp)
+        self.wp = WordPool.load(self.config.wp)
+        self._similarity_index = None
+        self.journal = StateJournal(os.path.join(exp.session.fullPath(), '..', 'state.journal'))
+
+    def restore_state(self):
+        """
+        Restores the state, including any progress recorded since it was last saved
+        :return: state object
+        """
+        state = self.exp.restoreState()
+        if state:
+            self.journal.replay(state)
+        return state
+
+    def save_progress(self, state, **changes):
+        """
+        Applies progress changes to the state and journals them,
+        without rewriting the full state
+        :param state: state object
+        :param changes: state attributes and their new values
+        """
+        for key, value in changes.items():
+            setattr(state, key, value)
+        self.journal.record(state.sessionNum, **changes)
+
+    def save_state(self, state, **kwargs):
+        """
+        Saves the full state, folding in the journaled progress
+        :param state: state object
+        :param kwargs: additional changes to save with the state
+        """
+        self.journal.compact(self.exp, state, **kwargs)
 
     def _show_prepare_message(self):
         """
@@ -228,15 +299,15 @@ then delete the subject folder in:
         """
         Reads the words from a session source file into a 2D array
         :param session_source_file: the filename to be read
-        :return: 2D array of words
+        :return: 2D array of positions of the words in the word pool
         """
         session_lists = [x.strip().split() for x in codecs.open(session_source_file, encoding='utf-8').readlines()]
 
         # Check to make sure they're all the right length
         assert all([len(this_list) == self.config.listLen for this_list in session_lists])
 
-        # Convert into TextPool items
-        return [[self.wp.findBy(name=word) for word in trial] for trial in session_lists]
+        # Convert into word pool positions
+        return [[self.wp.find(word) for word in trial] for trial in session_lists]
 
     def is_stim_experiment(self):
         """
@@ -292,21 +363,35 @@ then delete the subject folder in:
         nonstim_lists = session_lists[self.config.nStimTrials:]
         return stim_lists, nonstim_lists
 
+    def _read_practice_words(self):
+        """
+        :return: the words for the practice list
+        """
+        return [line.strip() for line in
+                codecs.open(self.config.practice_wordList,
+                            encoding='utf-8').readlines()]
+
+    def _make_practice_list(self, practice_words):
+        """
+        Pairs up the practice words for a single session
+        :param practice_words: the words for the practice list
+        :return: list of practice pairs
+        """
+        words = practice_words[:]
+        random.shuffle(words)
+        these_pairs = []
+        for __ in range(self.config.nPairs):
+            these_pairs.append((words.pop(), words.pop()))
+        return these_pairs
+
     def _prepare_practice_lists(self):
         """
         Prepares the words for the practice list
         """
-        practice_words = [line.strip() for line in
-                          codecs.open(self.config.practice_wordList,
-                                      encoding='utf-8').readlines()]
+        practice_words = self._read_practice_words()
         practice_pairs = []
         for _ in range(self.config.numSessions):
-            words = practice_words[:]
-            random.shuffle(words)
-            these_pairs = []
-            for __ in range(self.config.nPairs):
-                these_pairs.append((words.pop(), words.pop()))
-            practice_pairs.append(these_pairs)
+            practice_pairs.append(self._make_practice_list(practice_words))
         return practice_pairs
 
     def _prepare_all_sessions_lists(self):
@@ -332,6 +417,35 @@ then delete the subject folder in:
 
         return pairs_by_session, cue_dirs_by_session, stim_lists_by_session, test_order_by_session
 
+    def _make_batch_lists(self, n_sessions, seed):
+        """
+        Makes the lists for several sessions at once with BatchLists
+        :param n_sessions: number of sessions to make lists for
+        :param seed: 32 bit seed for the batch
+        :return: (pairs, cue_dirs, stim_lists, test_order, practice_pairs), one entry per session
+        """
+        self._assert_good_list_params()
+        self._verify_files()
+        practice_words = self._read_practice_words()
+        batch = BatchLists(seed, n_sessions, self.config.nTrials, self.config.nPairs,
+                           len(self.wp), len(practice_words),
+                           self.config.nBaselineTrials, self.config.nStimTrials, self.config.nControlTrials)
+        if self.config.maxPairSimilarity is not None:
+            sampler = self._make_list_sampler(random.Random(seed))
+            for session_words in batch.words:
+                lists = sampler.sample(session_words.ravel().tolist(), self.config.nTrials, 2 * self.config.nPairs)
+                session_words[...] = np.reshape(lists, session_words.shape)
+        return batch.to_lists(self.wp, practice_words)
+
+    def _make_list_sampler(self, rng=random):
+        """
+        :param rng: (optional) random.Random instance for the sampler. Defaults to the random module.
+        :return: ConstrainedListSampler that keeps similar words out of the same list
+        """
+        if not self._similarity_index:
+            self._similarity_index = SimilarityIndex.load(self.config.wp, self.config.similarityCacheDir)
+        return ConstrainedListSampler(self._similarity_index, self.config.maxPairSimilarity, rng=rng)
+
     def _make_latex_preamble(self):
         """
         Makes the preamble for the LaTeX document
@@ -351,20 +465,21 @@ then delete the subject folder in:
         ]
         return preamble
 
-    def make_stim_forms(self):
+    def make_stim_forms(self, processes=None):
         """
         Make the sheets stating which stim type to use per list
+        :param processes: (optional) number of processes to build the PDFs with
         """
         exp = self.exp
         state = self.exp.restoreState()
         config = self.config
         print 'making stim sheets'
         subj = exp.getOptions().get('subject')
+        jobs = []
         # Loop over sessions
         for session_i in range(config.nSessions):
             exp.setSession(session_i)
             form_name = '%s_%s_s%d_wordlists' % (subj, self.experiment_name, session_i)
-            stim_form = exp.session.createFile(form_name+'.tex')
 
             # Sets up the initial part of the LaTeX document
             preamble = [
@@ -383,6 +498,9 @@ then delete the subject folder in:
             # trial_stimFirst = None  # state.stimFirst[session_i] TODO: STIMULATION
             # trial_stimType = None  # state.stimType[session_i]
             trial_pairs = state.sessionPairs[session_i]
+            if trial_pairs is None:
+                # Lists for this session have not been made yet
+                continue
 
             already_page_broke = False
 
@@ -434,20 +552,12 @@ then delete the subject folder in:
 
             postamble = ['\\end{document}']
 
-            stim_form.write('\n'.join(preamble)+'\n'+'\n'.join(document)+'\n'+'\n'.join(postamble))
+            source = '\n'.join(preamble)+'\n'+'\n'.join(document)+'\n'+'\n'.join(postamble)
+            jobs.append((exp.session.fullPath(), form_name, source))
 
-            stim_form.close()
-
-            # Make the dvi document
-            os.system('cd %s; latex %s >> latexLog.txt' % (os.path.dirname(stim_form.name), stim_form.name))
-            # Convert the dvi to pdf
-            dvi_form = exp.session.createFile(form_name+'.dvi')
-            dvi_form.close()
-            os.system('cd %s; dvipdf %s >> latexLog.txt' % (os.path.dirname(dvi_form.name), dvi_form.name))
-
-            # Clean up unneccesary files
-            os.system('cd %s; rm %s.dvi; rm %s.log; rm %s.aux' % (os.path.dirname(dvi_form.name),
-                      form_name, form_name, form_name))
+        # Unchanged forms are not rebuilt
+        for form_name, build_time, reused in stim_forms.build_forms(jobs, processes):
+            print '%s: %s in %d ms' % (form_name, 'unchanged' if reused else 'built', build_time)
 
         exp.setSession(0)
 
@@ -460,7 +570,7 @@ then delete the subject folder in:
         """
         :return: True if this session has previously been started
         """
-        state = self.exp.restoreState()
+        state = self.restore_state()
         return state.session_started
 
     def is_experiment_started(self):
@@ -481,23 +591,38 @@ then delete the subject folder in:
         for session_i, (sess_pairs, these_practice_pairs) in enumerate(zip(session_lists, practice_pairs)):
             # Set the session so it writes the files in the correct place
             self.exp.setSession(session_i)
+            self._write_session_lst_files(sess_pairs, these_practice_pairs)
+
+    def _write_session_lst_files(self, sess_pairs, practice_pairs):
+        """
+        Writes the .lst files for the current session into a single list bundle.
+        Use list_bundle.ListBundle to read the individual <list>_<pair>.lst files.
+        :param sess_pairs: word lists for each list in the session
+        :param practice_pairs: practice list for the session
+        """
+        no_accents = {}
+        entries = []
+        for list_label, pairs in [('p', practice_pairs)] + list(enumerate(sess_pairs)):
+            contents = self._format_lst_contents(pairs, no_accents)
             for pair_i in range(self.config.nPairs):
-                self._write_single_lst_file(these_practice_pairs, 'p_%d.lst' % pair_i)
-            for list_i, pairs in enumerate(sess_pairs):
-                for pair_i in range(self.config.nPairs):
-                    self._write_single_lst_file(pairs, '%d_%d.lst' % (list_i, pair_i))
+                entries.append(('%s_%d.lst' % (list_label, pair_i), contents))
+        list_bundle.write_bundle(self.exp.session.createFile('lists.lstbundle'), entries)
 
-    def _write_single_lst_file(self, pairs, label):
+    @staticmethod
+    def _format_lst_contents(pairs, no_accents):
         """
-        Writes a single .lst file to the current session folder
+        Formats the contents of a single .lst file
         :param pairs: word list for that specific trial
-        :param label: name of the file to be written in the session folder
+        :param no_accents: dictionary of words already stripped of accents
+        :return: contents of the file
         """
-        list_file = self.exp.session.createFile(label)
+        lines = []
         for pair in pairs:
-            list_file.write('\n'.join([Utils.remove_accents(word) for word in pair]))
-            list_file.write('\n')
-        list_file.close()
+            for word in pair:
+                if word not in no_accents:
+                    no_accents[word] = Utils.remove_accents(word).encode('utf-8')
+                lines.append(no_accents[word])
+        return '\n'.join(lines) + '\n'
 
     def init_experiment(self):
         """
@@ -517,12 +642,23 @@ then delete the subject folder in:
         if self.video:
             self._show_prepare_message()
 
-        # Make the word lists
-        (session_pairs, session_cue_dirs, session_stim, session_test_order) = self._prepare_all_sessions_lists()
-        practice_pairs = self._prepare_practice_lists()
+        if self.config.lazySessionLists:
+            # Lists are made by prepare_session() when each session opens
+            self._assert_good_list_params()
+            self._verify_files()
+            session_pairs, session_cue_dirs, session_stim, session_test_order, practice_pairs = \
+                [[None] * self.config.numSessions for _ in range(5)]
+        elif self.config.batchListGeneration:
+            (session_pairs, session_cue_dirs, session_stim, session_test_order, practice_pairs) = \
+                self._make_batch_lists(self.config.numSessions, Utils.subject_seed(self.subject))
+            self._write_lst_files(session_pairs, practice_pairs)
+        else:
+            # Make the word lists
+            (session_pairs, session_cue_dirs, session_stim, session_test_order) = self._prepare_all_sessions_lists()
+            practice_pairs = self._prepare_practice_lists()
 
-        # Write out the .lst files
-        self._write_lst_files(session_pairs, practice_pairs)
+            # Write out the .lst files
+            self._write_lst_files(session_pairs, practice_pairs)
 
         # Save out the state
         state = self.exp.restoreState()
@@ -546,6 +682,53 @@ then delete the subject folder in:
         self.exp.setSession(0)
         return self.exp.restoreState()
 
+    def prepare_session(self, state):
+        """
+        Makes the lists for the current session if they have not been made yet.
+        Lists are seeded by subject and session, so any session can be remade
+        exactly, independent of the others.
+        :param state: state object
+        :return: state object with the session's lists filled in
+        """
+        session_num = state.sessionNum
+        if state.sessionPairs[session_num] is not None:
+            return state
+
+        if self.config.batchListGeneration:
+            pairs, cue_dirs, list_is_stim, test_order, practice_pairs = \
+                [lists[0] for lists in self._make_batch_lists(1, Utils.session_seed(self.subject, session_num) % 2**32)]
+        else:
+            Utils.seed_rng(Utils.session_seed(self.subject, session_num))
+            pairs, cue_dirs, test_order, list_is_stim = self._prepare_single_session_lists()
+            practice_pairs = self._make_practice_list(self._read_practice_words())
+
+        state.sessionPairs[session_num] = pairs
+        state.sessionCueDirs[session_num] = cue_dirs
+        state.sessionTestOrder[session_num] = test_order
+        state.sessionStim[session_num] = list_is_stim
+        state.practicePairs[session_num] = practice_pairs
+
+        self.exp.setSession(session_num)
+        self._write_session_lst_files(pairs, practice_pairs)
+        self.save_state(state)
+        return state
+
+    def prepare_all_sessions(self, state):
+        """
+        Makes the lists of every session that does not have them yet, as
+        prepare_session() would when each session opens
+        :param state: state object
+        :return: state object with every session's lists filled in
+        """
+        session_num = state.sessionNum
+        for i in range(len(state.sessionPairs)):
+            state.sessionNum = i
+            state = self.prepare_session(state)
+        state.sessionNum = session_num
+        self.exp.setSession(session_num)
+        self.save_state(state)
+        return state
+
     def get_stim_type(self):
         """
         Gets the type of stimulation for the given session
@@ -562,8 +745,11 @@ then delete the subject folder in:
         Makes all of the lists of pairs for a given session
         :return: (pres_pairs, cue_dir, test_order)
         """
-        wordpool = CustomTextPool(self.config.wp)
-        random.shuffle(wordpool)
+        word_order = self.wp.shuffled_order()
+        if self.config.maxPairSimilarity is not None:
+            # Regroup the shuffled words so that no list contains similar words
+            lists = self._make_list_sampler().sample(word_order, self.config.nTrials, 2 * self.config.nPairs)
+            word_order = [word for words in reversed(lists) for word in reversed(words)]
 
         pairs_per_session = self.config.nPairs*self.config.nTrials
         unused_cue_dirs = [0, 1]*(pairs_per_session/2)
@@ -580,7 +766,7 @@ then delete the subject folder in:
 
             these_pairs = []
             for pair_i in range(self.config.nPairs):
-                these_pairs.append((wordpool.pop().name, wordpool.pop().name))
+                these_pairs.append((self.wp[word_order.pop()], self.wp[word_order.pop()]))
             pres_pairs.append(these_pairs)
 
         return pres_pairs, cue_dirs, test_orders
@@ -602,11 +788,41 @@ class PALExperimentRunner:
         self.fr_experiment = fr_experiment
         self.config = fr_experiment.config
         self.clock = clock
-        self.log = log
-        self.mathlog = mathlog
+        # Plain LogTracks are buffered too, so writes always wait for the gaps between trials
+        self.log = log if isinstance(log, BufferedLog) else BufferedLog(log)
+        self.mathlog = mathlog if isinstance(mathlog, BufferedLog) else BufferedLog(mathlog)
         self.video = video
         self.audio = audio
-        self._on_screen = True
+        self.screen_updates = UpdateDispatcher(
+            lambda state, value: self._send_event('STATE', state=state, value=value, meta=None),
+            self.config.state_list)
+        self._screen_updates_ref = None
+        self.stimuli = StimulusCache(self.config.wordHeight)
+        self._orient_text = Text(self.config.encoding_orient_text, size=self.config.wordHeight)
+        self._retrieval_start_text = Text(self.config.retrieval_start_text, size=self.config.wordHeight)
+        self.events = EventPipeline.instance()
+        if self.config.control_pc and self.config.clockServer:
+            host, port = self.config.clockServer
+            self.clock_sync = ClockSync(UdpTransport(host, port), self.config.clockProbeInterval).start()
+            # session.log and math.log line for line, with times on the control PC's clock
+            self.log.mirror(LogTrack('session_remote'), self._to_remote)
+            self.mathlog.mirror(LogTrack('math_remote'), self._to_remote)
+        else:
+            self.clock_sync = None
+        self.timing_audit = TimingAudit()
+        # Background workers for finished recordings, started with the session
+        self.compressor = None
+        self.detector = None
+        self.segmenter = None
+        # Probe recording name -> (probe index, probe onset, recording start), until its vocal onset is logged
+        self._probe_recordings = {}
+        # Continuous recording name -> (recording start, segments with pre-cue windows), until it is cut
+        self._continuous_recordings = {}
+        self.math_bank = None
+        # (index, rendered Text) of the next problem from the bank
+        self._next_math_problem = None
+        # Typed answer -> rendered Text, for every answer that can be typed
+        self._math_answer_texts = {}
         self.start_beep = CustomBeep(self.config.startBeepFreq,
                              self.config.startBeepDur,
                              self.config.startBeepRiseFall)
@@ -619,10 +835,101 @@ class PALExperimentRunner:
         """
         if not time:
             time = self.clock
-        if isinstance(message, unicode):
-            message = unicodedata.normalize('NFKD', message).encode('ascii', 'ignore')
         self.log.logMessage(message, time)
 
+    def _flush_logs(self):
+        """
+        Writes out the buffered session and math logs.
+        Should only be called between trials.
+        """
+        # Lines for the list that just ended are placed among the held records, so wait for all of them
+        if self.segmenter:
+            self.segmenter.flush()
+            self._log_recall_segments()
+        if self.detector:
+            self.detector.flush()
+            self._log_vocal_onsets(late=True)
+        self.log.flush()
+        self.mathlog.flush()
+
+    def _log_recall_segments(self):
+        """
+        Logs the sample offsets of the per-probe recordings cut so far
+        from the continuous retrieval recordings, each placed in the log
+        at the end of its segment
+        """
+        for name, start_sample, end_sample, rate, end_time in self.segmenter.results():
+            if start_sample is None:
+                self.log.insertMessage('REC_SEGMENT_FAILED\t%s' % name, (end_time, 0))
+            else:
+                self.log.insertMessage('REC_SEGMENT\t%s\t%d\t%d\t%d' % (name, start_sample, end_sample, rate),
+                                       (end_time, 0))
+
+    def _start_recording_workers(self):
+        """
+        Starts the configured background workers for finished recordings.
+        Must be called once the session directory is set.
+        """
+        directory = self.fr_experiment.exp.session.fullPath()
+        if self.config.compressRecordings:
+            self.compressor = AudioCompressor(directory, keep_originals=self.config.keepUncompressedRecordings)
+        if self.config.detectVocalOnsets:
+            self.detector = OnsetDetector(directory, on_done=self.compressor.submit if self.compressor else None)
+        if self.config.continuousRecall:
+            self.segmenter = RecallSegmenter(on_cut=self._recordings_finished)
+
+    def _recordings_finished(self, names):
+        """
+        Passes finished recordings on for onset detection and compression.
+        May be called from background threads.
+        :param names: names of the recordings, without .wav
+        """
+        if self.detector:
+            if self.segmenter:
+                # Analysed before compression may remove it; the segments themselves need no analysis
+                analysed = [name for name in names if name in self._continuous_recordings]
+                for name in analysed:
+                    self.detector.submit_continuous(name, *self._continuous_recordings.pop(name))
+            else:
+                analysed = [name for name in names if name in self._probe_recordings]
+                self.detector.submit(analysed)
+            names = [name for name in names if name not in analysed]
+        if self.compressor:
+            self.compressor.submit(names)
+
+    def _calibrate_noise_floor(self):
+        """
+        Records a short silence after the mic test, to measure the noise floor
+        that vocal onsets in per-probe recordings are detected against
+        """
+        self.clock.delay(self.config.noiseFloorDelay)
+        (_, timestamp) = self.audio.startRecording('noise_floor', t=self.clock)
+        self.log_message('NOISE_FLOOR_REC_START', timestamp)
+        self.clock.delay(self.config.noiseFloorDuration)
+        (_, timestamp) = self.audio.stopRecording(self.clock)
+        self.log_message('NOISE_FLOOR_REC_END', timestamp)
+        noise_floor = self.detector.calibrate('noise_floor')
+        if noise_floor is None:
+            logger.warning('Noise floor recording is too short')
+        else:
+            self.log_message('NOISE_FLOOR\t%.1f' % noise_floor)
+        self._recordings_finished(['noise_floor'])
+
+    def _log_vocal_onsets(self, late=False):
+        """
+        Logs the vocalization onsets detected so far, relative to probe onset.
+        Each is placed in the log at the time of the onset itself.
+        :param late: True if called after the probes' list has ended
+        """
+        for name, onset in self.detector.results(late):
+            probe_i, probe_time, rec_start = self._probe_recordings.pop(name)
+            if onset is None:
+                self.log.insertMessage('NO_VOCALIZATION\t%d\t%s' % (probe_i, name), (probe_time, 0))
+            else:
+                latency = rec_start + onset - probe_time
+                self.log.insertMessage('VOCALIZATION_ONSET\t%d\t%s\t%d' % (probe_i, name, latency),
+                                       (probe_time + latency, 0))
+
     @staticmethod
     def choose_yes_or_no(message):
         """
@@ -685,14 +992,21 @@ class PALExperimentRunner:
 
     def _send_event(self, type, *args, **kwargs):
         """
-        Sends an arbitrary event
+        Sends an arbitrary event. The timestamp is taken now, but the message
+        is built and sent on the event pipeline's thread.
         :param args: Inputs to RAMControl.sendEvent()
         """
         if 'timestamp' not in kwargs:
             kwargs['timestamp'] = timing.now()
 
         if self.config.control_pc:
-            ram_control.send(ram_control.build_message(type, *args, **kwargs))
+            self.events.put(self._build_and_send, type, args, kwargs)
+            if type in EventPipeline.FLUSH_TYPES:
+                self.events.flush()
+
+    @staticmethod
+    def _build_and_send(type, args, kwargs):
+        ram_control.send(ram_control.build_message(type, *args, **kwargs))
 
     def _show_message_from_file(self, filename):
         """
@@ -703,13 +1017,18 @@ class PALExperimentRunner:
                                   onscreenCallback=lambda: self._send_state_message('INSTRUCT', True),
                                   offscreenCallback=lambda: self._send_state_message('INSTRUCT', False))
 
-    def _add_update_callback(self, callback):
-        self._update_callback = callback
-        self.video.addUpdateCallback(self._update_callback)
-        self._cbref = self.video.update_callbacks[-1]
+    def _register_screen_updates(self):
+        """
+        Registers the screen update dispatcher with the video track, for the rest of the session
+        """
+        if self._screen_updates_ref is None:
+            self.video.addUpdateCallback(self.screen_updates)
+            self._screen_updates_ref = self.video.update_callbacks[-1]
 
-    def _remove_update_callback(self):
-        self.video.removeUpdateCallback(self._cbref)
+    def _unregister_screen_updates(self):
+        if self._screen_updates_ref is not None:
+            self.video.removeUpdateCallback(self._screen_updates_ref)
+            self._screen_updates_ref = None
 
     def _run_practice_list(self, state):
         """
@@ -727,42 +1046,49 @@ class PALExperimentRunner:
         self._send_state_message('PRACTICE', False)
 
         # Log in state that list has been run
-        state.practiceDone = True
-        self.fr_experiment.exp.saveState(state)
+        self.fr_experiment.save_progress(state, practiceDone=True)
+        self._flush_logs()
 
         # Show a message afterwards
         self._show_message_from_file(self.config.post_practiceList)
 
-    def play_whole_movie(self, movie_file):
+    def play_whole_movie(self, movie_file, while_playing=None):
         """
         :param movie_file: path to the movie file to play
+        :param while_playing: (optional) function to run once the movie has started
         Plays any movie file, centered on the screen.
         """
-        movie_object = Movie(movie_file)
-        movie_shown = self.video.showCentered(movie_object)
-        self.video.playMovie(movie_object)
+        movie_cache = MovieCache.instance()
+        movie_object, movie_shown = movie_cache.start(self.video, movie_file)
+        self.log_message('MOVIE_START')
+        if while_playing:
+            while_playing()
         self.clock.delay(movie_object.getTotalTime())
         self.clock.wait()
-        self.video.stopMovie(movie_object)
-        self.video.unshow(movie_shown)
+        start_time, latency, rewound = movie_cache.stop(self.video, movie_object, movie_shown)
+        if latency is not None:
+            self.log.insertMessage('MOVIE_FIRST_FRAME\t%d' % latency, (start_time + latency, 0))
+        if not rewound:
+            self.log_message('MOVIE_RELOAD\t%s' % movie_file)
 
-    def _countdown(self):
+    def _countdown(self, while_playing=None):
         """
         Shows the 'countdown' video, centered.
+        :param while_playing: (optional) function to run during the countdown
         """
         self.video.clear('black')
         self._send_state_message('COUNTDOWN', True)
         self.log_message('COUNTDOWN_START')
-        self.play_whole_movie(self.config.countdownMovie)
+        self.play_whole_movie(self.config.countdownMovie, while_playing)
         self._send_state_message('COUNTDOWN', False)
         self.log_message('COUNTDOWN_END')
 
-    def _on_orient_update(self, *_):
-        if self._on_screen:
-            self._send_state_message('ORIENT', True)
-        else:
-            self._send_state_message('ORIENT', False)
-        self._on_screen = not self._on_screen
+    def _prebuild_stimuli(self, pair_list, cue_dirs, rec_order):
+        """
+        Renders all pairs and probes of the upcoming list
+        """
+        prebuild_time = self.stimuli.prebuild(pair_list, cue_dirs, rec_order)
+        self.log_message('STIM_PREBUILD\t%d' % prebuild_time)
 
     def _run_list(self, pair_list, cue_dirs=None, rec_order=None, state=None, is_stim=False, is_practice=False):
         """
@@ -797,19 +1123,37 @@ class PALExperimentRunner:
             self.log_message('TRIAL\t%d\t%s' %
                              (state.trialNum + 1, 'STIM' if is_stim else 'NONSTIM'), timestamp)
 
+        if is_practice:
+            cue_dirs = [i % 2 for i in range(len(pair_list))]
+            random.shuffle(cue_dirs)
+            rec_order = self.fr_experiment.make_test_order()
+
+        schedule = compile_list(self.config, pair_list, cue_dirs, rec_order,
+                                str(state.trialNum) if not is_practice else 'p', self.log.fold,
+                                is_stim, is_practice)
+        schedule.save(self.fr_experiment.exp.session.createFile('schedule_%s.json' % schedule.label))
+
         # Need a synchronization close to the start of the list
         self._resynchronize(False)
 
-        # Countdown to start...
-        self._countdown()
+        # Countdown to start, rendering the list's stimuli in the meantime
+        self._countdown(lambda: self._prebuild_stimuli(pair_list, cue_dirs, rec_order))
 
+        self._run_schedule(schedule, state)
+
+    def _run_schedule(self, schedule, state=None):
+        """
+        Runs the encoding, distractor and retrieval periods of a compiled list
+        :param schedule: ListSchedule of the list, whose stimuli have been prebuilt
+        :param state: State object
+        """
         self.clock.tare()
-        encoding_state = 'NON-STIM ENCODING' if not is_stim else 'STIM ENCODING'
+        encoding_state = 'NON-STIM ENCODING' if not schedule.is_stim else 'STIM ENCODING'
         self._send_state_message(encoding_state, True)
         self.log_message('ENCODING_START')
         # ENCODING
-        for pair_i, pair in enumerate(pair_list):
-            self._present_pair(pair, pair_i, is_stim, is_practice, state.trialNum if state else None)
+        for step in schedule.study_steps:
+            self._present_pair(step, schedule)
 
         self.clock.tare()
         self._send_state_message(encoding_state, False)
@@ -820,126 +1164,160 @@ class PALExperimentRunner:
                 not self.config.fastConfig:
             self._do_distractor()
 
-        self._run_recall(pair_list, cue_dirs, rec_order, is_practice, state)
+        self._run_recall(schedule, state)
+        self.stimuli.evict()
 
-    def _run_recall(self, pair_list, cue_dirs, rec_order,  is_practice=False, state=None,):
+    def _run_recall(self, schedule, state=None):
         """
         Runs the recall period of a word list
+        :param schedule: ListSchedule of the list
         :param state: State object
-        :param is_practice: True if list is practice list
         """
 
         self.clock.tare()
         self._send_state_message('RETRIEVAL', True)
         self.log_message('RECALL_START')
-        if is_practice:
-            cue_dirs = [i%2 for i in range(len(pair_list))]
-            random.shuffle(cue_dirs)
-            rec_order = self.fr_experiment.make_test_order()
-        elif not state:
+        if not schedule.is_practice and not state:
             raise Exception('State not provided on practice list')
     
-        start_shown = self.video.showCentered(Text(self.config.retrieval_start_text, size=self.config.wordHeight))
+        start_shown = self.video.showCentered(self._retrieval_start_text)
         self.video.updateScreen(self.clock)
         self.start_beep.present(self.clock)
         self.video.unshow(start_shown)
         self.video.updateScreen(self.clock)
 
-        for i, (pair_i, cue_dir) in enumerate(zip(rec_order, cue_dirs)):
-            pair = pair_list[pair_i]
-            probe = pair[cue_dir]
-            expecting = pair[(cue_dir + 1) % 2]
+        label = schedule.label
+        durations = schedule.timing
+        continuous = self.segmenter is not None
+        if continuous:
+            # One recording for the whole retrieval period, cut up once it ends
+            segments = []
+            planned = self.clock.get()
+            (_, recall_start) = self.audio.startRecording('%s_recall' % label, t=self.clock)
+            self.timing_audit.record('REC_START', planned, recall_start)
+            self.log_message('REC_START\t%s_recall' % label, recall_start)
+            # The subject should be silent from the end of one segment to the next probe
+            pre_cue_start = recall_start[0]
+
+        for step in schedule.probe_steps:
+            i = step.probe_i
 
             #self._orient(self.config.retrieval_orient_text,
             #             self.config.cue_orientation,
             #             'RETRIEVAL_' if not is_practice else 'PRACTICE_RETRIEVAL_')
             # NO ORIENT IN RETRIEVAL ANYMORE
 
-            self.clock.delay(self.config.cue_orientation + self.config.pre_cue, jitter=self.config.pre_cue_jitter)
+            self.clock.delay(step.pre_delay)
+            if self.detector:
+                # Collected while waiting for the probe, so it never delays it
+                self._log_vocal_onsets()
             self.clock.wait()
 
-            probe_handle = self.video.showCentered(Text(probe, size=self.config.wordHeight))
+            probe_handle = self.video.showCentered(self.stimuli.probes[i])
 
-            self._add_update_callback(self._on_word_update)
+            self.screen_updates.present('WORD', ('TEST_PROBE', label, i))
+            planned = self.clock.get()
             timestamp = self.video.updateScreen(self.clock)
+            self.timing_audit.record('TEST_PROBE', planned, timestamp)
+            probe_time = timestamp[0]
 
-            label = str(state.trialNum) if not is_practice else 'p'
-
-            self.log_message('TEST_PROBE\t%d\tSP_%d\tTRIAL_%s\tPROBE_%s\tEXPECTING_%s\tDIRECTION_%d' %
-                             (i, pair_i, label, probe, expecting, cue_dir), timestamp)
+            self.log_message(step.probe_log, timestamp)
 
-            filename = '%s_%d' % (label, i)
-            (_, timestamp) = self.audio.startRecording(filename, t=self.clock)
-            self.log_message('REC_START', timestamp)
-            self.clock.delay(self.config.cue_duration)
+            filename = step.filename
+            if continuous:
+                # The probe's segment of the running recording starts with the probe
+                segment_start = timestamp[0]
+                self.log_message('REC_SEGMENT_START\t%s' % filename, timestamp)
+            else:
+                planned = self.clock.get()
+                (_, timestamp) = self.audio.startRecording(filename, t=self.clock)
+                self.timing_audit.record('REC_START', planned, timestamp)
+                self.log_message('REC_START', timestamp)
+            if self.detector:
+                self._probe_recordings[filename] = (i, probe_time, timestamp[0])
+            self.clock.delay(durations['cue_duration'])
             self.video.unshow(probe_handle)
+            planned = self.clock.get()
             timestamp = self.video.updateScreen(self.clock)
+            self.timing_audit.record('PROBE_OFF', planned, timestamp)
             self.log_message('PROBE_OFF', timestamp)
-            self._remove_update_callback()
+            self.screen_updates.done()
 
-            self.clock.delay(self.config.post_cue)
+            self.clock.delay(durations['post_cue'])
             self.clock.wait()
+            if continuous:
+                # The recording keeps running, so the segment ends when the post-cue period actually did
+                timestamp = (timing.now(), 0)
+                segments.append((filename, pre_cue_start, segment_start, timestamp[0]))
+                pre_cue_start = timestamp[0]
+                self.log_message('REC_SEGMENT_END\t%s' % filename, timestamp)
+            else:
+                planned = self.clock.get()
+                (_, timestamp) = self.audio.stopRecording(self.clock)
+                self.timing_audit.record('REC_END', planned, timestamp)
+                self._recordings_finished([filename])
+                self.log_message('REC_END', timestamp)
+
+        if continuous:
+            planned = self.clock.get()
             (_, timestamp) = self.audio.stopRecording(self.clock)
-            self.log_message('REC_END', timestamp)
+            self.timing_audit.record('REC_END', planned, timestamp)
+            self.log_message('REC_END\t%s_recall' % label, timestamp)
+            if self.detector:
+                self._continuous_recordings['%s_recall' % label] = (recall_start[0], segments)
+            self.segmenter.submit(self.fr_experiment.exp.session.fullPath(), '%s_recall' % label, recall_start[0],
+                                  [segment[:1] + segment[2:] for segment in segments])
+        elif self.detector:
+            self.detector.flush()
+            self._log_vocal_onsets()
         self.clock.tare()
         self._send_state_message('RETRIEVAL', False)
         self.log_message('RECALL_END')
 
-    def _on_word_update(self, *_):
-        self._send_state_message('WORD', self._on_screen)
-        self._on_screen = not self._on_screen
-
-    def _orient(self, text, duration, list_type):
+    def _orient(self, schedule, pair_i):
 
-        self._add_update_callback(self._on_orient_update)
-        timestamp_on, timestamp_off = flashStimulusWithOffscreenTimestamp(Text(text, size=self.config.wordHeight),
+        self.screen_updates.present('ORIENT', ('ORIENT', schedule.label, pair_i))
+        planned = self.clock.get()
+        timestamp_on, timestamp_off = flashStimulusWithOffscreenTimestamp(self._orient_text,
                                                                           clk=self.clock,
-                                                                          duration=duration)
-        self._remove_update_callback()
-        self.log_message('%sORIENT' % list_type, timestamp_on)
-        self.log_message('%sORIENT_OFF' % list_type, timestamp_off)
+                                                                          duration=schedule.timing['orientation'])
+        self.screen_updates.done()
+        self.timing_audit.record('ORIENT', planned, timestamp_on)
+        self.log_message(schedule.logs['orient'], timestamp_on)
+        self.log_message(schedule.logs['orient_off'], timestamp_off)
         self.video.clear('black')
         self.video.updateScreen()
 
-    def _present_pair(self, pair, pair_i, is_stim=False, is_practice=False, list_num=None):
+    def _present_pair(self, step, schedule):
         """
-        Presents a single word to the subject
-        :param pair: the wordpool object of the word to present
-        :param pair_i: the serial position of the word in the list
-        :param is_stim: Whether or not this is a (potentially) stimulated word
-        :param is_practice: Whether this is a practice list
+        Presents a single word pair to the subject
+        :param step: StudyStep of the pair
+        :param schedule: ListSchedule of the list
         """
 
-        self._orient(self.config.encoding_orient_text, self.config.encoding_orientation,
-                     'STUDY_' if not is_practice else 'PRACTICE_')
+        self._orient(schedule, step.pair_i)
 
         # Get the text to present
-        word_text = CustomText('\n\n'.join(pair), size=self.config.wordHeight)
+        word_text = self.stimuli.pairs[step.pair_i]
 
         # Delay for a moment
-        self.clock.delay(self.config.pre_encoding_delay, self.config.pre_encoding_jitter)
+        self.clock.delay(step.pre_delay)
         self.clock.wait()
 
         # Present the word
-        timestamp_on, timestamp_off = word_text.presentWithCallback(clk=self.clock,
-                                                                    duration=self.config.encoding_duration,
-                                                                    updateCallback=self._on_word_update)
+        duration = schedule.timing['encoding_duration']
+        self.screen_updates.present('WORD', ('STUDY_PAIR', schedule.label, step.pair_i))
+        planned = self.clock.get()
+        timestamp_on, timestamp_off = word_text.presentWithCallback(clk=self.clock, duration=duration)
+        self.screen_updates.done()
+        self.timing_audit.record('STUDY_PAIR', planned, timestamp_on)
+        self.timing_audit.record('PAIR_OFF', planned + duration, timestamp_off)
         # Log that we showed the word
-        ram_control.send(WordMessage('{}-{}'.format(pair[0], pair[1])))
-        if not is_practice:
-            self.log_message(u'STUDY_PAIR\t%d\tTRIAL_%s\tWORD1_%s\tWORD2_%s\t%s' %
-                             (pair_i, list_num,
-                              pair[0], pair[1],
-                              'STIM' if is_stim else 'NO_STIM'), timestamp_on)
-            self.log_message(u'PAIR_OFF', timestamp_off)
-        else:
-            self.log_message(u'PRACTICE_PAIR\t%d\tWORD1_%s\tWORD2_%s' %
-                             (pair_i,
-                              pair[0], pair[1]
-                              ), timestamp_on)
-            self.log_message(u'PRACTICE_PAIR_OFF', timestamp_off)
+        self.events.put(ram_control.send, WordMessage(step.word_message))
+        self.log_message(step.study_log, timestamp_on)
+        self.log_message(schedule.logs['pair_off'], timestamp_off)
 
-        self.clock.delay(self.config.post_cue)
+        self.clock.delay(schedule.timing['post_pair'])
         self.clock.wait()
         if self.config.continuousDistract:
             self._do_distractor()
@@ -952,18 +1330,139 @@ class PALExperimentRunner:
         self._send_state_message('DISTRACT', True)
         self.log_message('DISTRACT_START')
 
-        customMathDistract(clk=self.clock,
-                           mathlog=self.mathlog,
-                           numVars=self.config.MATH_numVars,
-                           maxProbs=self.config.MATH_maxProbs,
-                           plusAndMinus=self.config.MATH_plusAndMinus,
-                           minDuration=self.config.MATH_minDuration,
-                           textSize=self.config.MATH_textSize,
-                           callback=ram_control.send_math_message)
+        if self.math_bank:
+            self._run_math_bank(self.config.MATH_minDuration)
+        else:
+            customMathDistract(clk=self.clock,
+                               mathlog=self.mathlog,
+                               numVars=self.config.MATH_numVars,
+                               maxProbs=self.config.MATH_maxProbs,
+                               plusAndMinus=self.config.MATH_plusAndMinus,
+                               minDuration=self.config.MATH_minDuration,
+                               textSize=self.config.MATH_textSize,
+                               callback=self._send_math_message)
 
         self._send_state_message('DISTRACT', False)
         self.log_message('DISTRACT_END')
 
+    def _prepare_math_bank(self, state):
+        """
+        Generates the session's math problems, if the problem bank is used
+        :param state: experiment state
+        """
+        if not self.config.mathProblemBank:
+            return
+        config = self.config
+        self.math_bank = MathBank(Utils.session_seed(self.fr_experiment.subject, state.sessionNum) % 2 ** 32,
+                                  config.MATH_bankSize,
+                                  config.MATH_numVars,
+                                  config.MATH_minNum,
+                                  config.MATH_maxNum,
+                                  config.MATH_plusAndMinus)
+        submit_keys = [Key('RETURN'), Key('KP_ENTER')]
+        digit_keys = [Key(str(digit)) for digit in range(10)] + [Key('KP%d' % digit) for digit in range(10)]
+        self._math_keys = ButtonChooser(*(digit_keys + [Key('BACKSPACE')] + submit_keys))
+        # Once the longest possible answer has been typed
+        self._math_full_keys = ButtonChooser(*(submit_keys + [Key('BACKSPACE')]))
+        self._math_submit_names = [key.name for key in submit_keys]
+        self._math_correct_beep = CustomBeep(config.MATH_correctBeepFreq,
+                                             config.MATH_correctBeepDur,
+                                             config.MATH_correctBeepRF)
+        self._math_incorrect_beep = CustomBeep(config.MATH_incorrectBeepFreq,
+                                               config.MATH_incorrectBeepDur,
+                                               config.MATH_incorrectBeepRF)
+        self._render_math_answers()
+
+    def _render_math_answers(self):
+        """
+        Renders every string of digits up to the longest answer in the bank,
+        once per session, so that a key press only has to show an existing Text
+        """
+        for text in self._math_answer_texts.values():
+            text.unload()
+        self._math_answer_texts = {}
+        answers = ['']
+        for _ in range(self.math_bank.max_answer_length):
+            answers = [answer + digit for answer in answers for digit in '0123456789']
+            for answer in answers:
+                text = self._math_answer_texts[answer] = Text(answer, size=self.config.MATH_textSize)
+                text.load()
+
+    def _render_next_math_problem(self):
+        """
+        :return: (index, rendered Text) of the next problem from the bank
+        """
+        problem_i = self.math_bank.next_problem()
+        text = Text(self.math_bank.texts[problem_i], size=self.config.MATH_textSize)
+        text.load()
+        return problem_i, text
+
+    def _run_math_bank(self, min_duration):
+        """
+        Presents problems from the session's problem bank until min_duration has passed.
+        Each answer is logged to math.log and sent to the control PC.
+
+        Nothing is rendered between a key press and the screen update it
+        causes, or while the subject is typing. Each problem is rendered
+        while the previous one is on screen (the first during the previous
+        distractor) and shown ending at the middle of the screen. The typed
+        answer is shown starting there, from the Texts rendered when the
+        session started.
+        :param min_duration: time (ms) after which no new problems are started
+        """
+        bank = self.math_bank
+        start = self.clock.get()
+        self.mathlog.logMessage('START', self.clock)
+        n_problems = 0
+        middle = self.video.propToPixel(.5, .5)
+        if self._next_math_problem is None:
+            self._next_math_problem = self._render_next_math_problem()
+        while self.clock.get() - start < min_duration and n_problems < self.config.MATH_maxProbs:
+            problem_i, problem_text = self._next_math_problem
+            problem = bank.texts[problem_i]
+            typed = ''
+            problem_shown = self.video.showAnchored(problem_text, EAST, middle)
+            answer_shown = None
+            problem_time = self.video.updateScreen(self.clock)
+
+            self._next_math_problem = self._render_next_math_problem()
+
+            while True:
+                keys = self._math_keys if len(typed) < bank.max_answer_length else self._math_full_keys
+                key, timestamp = keys.waitWithTime(clock=self.clock)
+                self.clock.tare()
+                if key.name in self._math_submit_names:
+                    if typed:
+                        break
+                    continue
+                typed = typed[:-1] if key.name == 'BACKSPACE' else typed + key.name[-1]
+                if answer_shown:
+                    self.video.unshow(answer_shown)
+                    answer_shown = None
+                if typed:
+                    answer_shown = self.video.showAnchored(self._math_answer_texts[typed], WEST, middle)
+                self.video.updateScreen(self.clock)
+
+            correct = bank.is_correct(problem_i, typed)
+            response_time = timestamp[0] - problem_time[0]
+            self.video.unshow(problem_shown)
+            if answer_shown:
+                self.video.unshow(answer_shown)
+            self.video.updateScreen(self.clock)
+            (self._math_correct_beep if correct else self._math_incorrect_beep).present(self.clock)
+            self.mathlog.logMessage('PROB\t%r\t%r\t%s\t%d' % (problem, typed, correct, response_time),
+                                    problem_time)
+            self._send_math_message(problem, typed, correct, response_time)
+            n_problems += 1
+            problem_text.unload()
+        self.mathlog.logMessage('STOP', self.clock)
+
+    def _send_math_message(self, *args, **kwargs):
+        """
+        Queues a math distractor message for the control PC
+        """
+        self.events.put(lambda: ram_control.send_math_message(*args, **kwargs))
+
     def should_skip_session(self, state):
         """
         Check if session should be skipped
@@ -984,7 +1483,7 @@ class PALExperimentRunner:
                 state.trialNum = 0
                 state.practiceDone = False
                 state.session_started = False
-                self.fr_experiment.exp.saveState(state)
+                self.fr_experiment.save_state(state)
                 waitForAnyKey(self.clock, Text('Session skipped\nRestart RAM_%s to run next session' %
                                                self.config.experiment))
                 return True
@@ -992,16 +1491,28 @@ class PALExperimentRunner:
 
     def _resynchronize(self, show_syncing):
         """
-        Performs a resynchronization (christian's algorithm)
-        (to be run before each list)
+        Asks the clock alignment service for a burst of probes while the task
+        is idle (to be run before each list), and logs its current clock model.
+        Does not block.
+        :param show_syncing: unused, kept for existing callers
         """
-        logger.error("Resync currently disabled")
-        return
-        if self.config.control_pc:
-            if show_syncing:
-                ram_control.align_clocks(callback=self.resync_callback)
-            else:
-                ram_control.align_clocks()
+        if not self.clock_sync:
+            return
+        self.clock_sync.burst()
+        model = self.clock_sync.model
+        if model:
+            self.log_message('CLOCK_MODEL\t%.3f\t%.6f\t%.1f\t%d\t%.2f' %
+                             (model.offset, model.drift * 1e6, model.reference, model.n_samples, model.rtt))
+
+    def _to_remote(self, timestamp):
+        """
+        :param timestamp: (time, latency) on the task computer's clock
+        :return: (time, latency) on the control PC's clock, or None if there is no clock model yet
+        """
+        model = self.clock_sync.model
+        if model is None:
+            return None
+        return int(round(model.to_remote(timestamp[0]))), timestamp[1]
 
     def _run_all_lists(self, state):
         """
@@ -1019,8 +1530,8 @@ class PALExperimentRunner:
             test_order = test_orders[state.trialNum]
             # Sync with NP 10 more times over 2.5 secs
             self._run_list(this_list, cue_dir, test_order, state, is_stim)
-            state.trialNum += 1
-            self.fr_experiment.exp.saveState(state)
+            self.fr_experiment.save_progress(state, trialNum=state.trialNum + 1)
+            self._flush_logs()
             self._resynchronize(True)
 
     def run_session(self, keyboard):
@@ -1040,8 +1551,11 @@ class PALExperimentRunner:
         elif config.show_instruct_text:
             instruct(codecs.open(config.intro_file, 'r', 'utf-8').read())
 
+        # Decode the countdown once, so every list plays it from memory
+        MovieCache.instance().get(config.countdownMovie)
+
         # Get the state object
-        state = self.fr_experiment.exp.restoreState()
+        state = self.fr_experiment.restore_state()
 
         # Return if out of sessions
         if self.is_out_of_sessions(state):
@@ -1049,6 +1563,10 @@ class PALExperimentRunner:
 
         # Set the session appropriately for recording files
         self.fr_experiment.exp.setSession(state.sessionNum)
+        state = self.fr_experiment.prepare_session(state)
+        self._start_recording_workers()
+        self._prepare_math_bank(state)
+        self._register_screen_updates()
 
         # Clear the screen
         self.video.clear('black')
@@ -1074,27 +1592,52 @@ class PALExperimentRunner:
         if not customMicTest(2000, 1.0):
             return
         self._send_state_message('MIC TEST', False)
+        if self.detector:
+            self._calibrate_noise_floor()
 
         if state.trialNum == 0 and self._check_should_run_practice(state):
             self._resynchronize(False)
             self._run_practice_list(state)
             self._resynchronize(True)
-            state = self.fr_experiment.exp.restoreState()
-        
-        self.fr_experiment.exp.saveState(state, session_started=True)
-        state = self.fr_experiment.exp.restoreState()
+
+        self.fr_experiment.save_progress(state, session_started=True)
 
         self._run_all_lists(state)
 
-        self.fr_experiment.exp.saveState(state,
-                                         trialNum=0,
-                                         session_started=False,
-                                         sessionNum=state.sessionNum+1,
-                                         practiceDone=False)
+        self.fr_experiment.save_state(state,
+                                      trialNum=0,
+                                      session_started=False,
+                                      sessionNum=state.sessionNum+1,
+                                      practiceDone=False)
 
         timestamp = waitForAnyKey(self.clock, Text('Thank you!\nYou have completed the session.'))
         self.log_message('SESS_END', timestamp)
         self._send_event('EXIT')
+        logger.info('Control PC pipeline: %s' % self.events.stats())
+        if self.clock_sync:
+            self._resynchronize(False)
+            logger.info('Clock alignment: %s (%d of %d probes lost)' %
+                        (self.clock_sync.model.describe() if self.clock_sync.model else 'no model',
+                         self.clock_sync.n_lost, self.clock_sync.n_probes))
+            self.clock_sync.stop()
+        if self.segmenter:
+            self.segmenter.flush()
+        if self.detector:
+            self.detector.flush()
+            self.detector.write_report(self.fr_experiment.exp.session.createFile('vad_report.txt'),
+                                       self.config.cue_orientation + self.config.pre_cue)
+        if self.compressor:
+            self.compressor.flush()
+            logger.info('Recordings: %s' % self.compressor.stats())
+        self._flush_logs()
+        self.timing_audit.write_report(self.fr_experiment.exp.session.createFile('timing_report.txt'))
+        self._unregister_screen_updates()
+        logger.info('Screen updates: %s' % self.screen_updates.report())
+        self.screen_updates.write_report(self.fr_experiment.exp.session.createFile('screen_updates.txt'))
+        heartbeat = Heartbeat.instance()
+        if heartbeat.is_running():
+            logger.info(heartbeat.report())
+            heartbeat.write_report(self.fr_experiment.exp.session.createFile('heartbeat_report.txt'))
 
         self.clock.wait()
 
@@ -1112,6 +1655,8 @@ def cleanup_ram_control():
     Cleanup anything related to the Control PC
     Close connections, terminate threads.
     """
+    Heartbeat.instance().stop()
+    EventPipeline.instance().shutdown()
 
 
 # noinspection PyShadowingBuiltins
@@ -1121,11 +1666,23 @@ def exit(num):
     Override sys.exit since Python does not exit until all threads have exited
     """
     try:
+        BufferedLog.flush_all()
         cleanup_ram_control()
     finally:
         sys.exit(num)
 
 
+def restore_or_init_state(fr_experiment):
+    """
+    :param fr_experiment: PALExperiment object
+    :return: the saved state with any journaled progress replayed over it,
+             or a new state if the experiment has not been started
+    """
+    if not fr_experiment.is_experiment_started():
+        return fr_experiment.init_experiment()
+    return fr_experiment.restore_state()
+
+
 def connect_to_control_pc(subject, session, config):
     """
     establish connection to control PC
@@ -1146,6 +1703,12 @@ def connect_to_control_pc(subject, session, config):
     cb = lambda: flashStimulus(Text("Waiting for start from control PC..."))
     ram_control.wait_for_start_message(poll_callback=cb)
 
+    if getattr(config, 'heartbeat_interval', None):
+        # Heartbeats go out on their own thread. RAMControl has a single connection to the control PC, so they
+        # share it with the event pipeline; time spent waiting for it is reported in heartbeat_report.txt.
+        send_heartbeat = lambda: ram_control.send(ram_control.build_message('HEARTBEAT', timestamp=timing.now()))
+        Heartbeat.instance().start(send_heartbeat, config.heartbeat_interval, EventPipeline.instance().send_lock)
+
 
 def run():
     """
@@ -1182,13 +1745,10 @@ def run():
 
     fr_experiment = PALExperiment(exp, config, video, clock)
 
-    if not fr_experiment.is_experiment_started():
-        state = fr_experiment.init_experiment()
-    else:
-        state = exp.restoreState()
+    state = restore_or_init_state(fr_experiment)
 
-    log = LogTrack('session')
-    mathlog = LogTrack('math')
+    log = BufferedLog(LogTrack('session'))
+    mathlog = BufferedLog(LogTrack('math'))
     audio = CustomAudioTrack('audio')
     keyboard = KeyTrack('keyboard')
 
@@ -0,0 +1,100 @@
+import os
+import subprocess
+import threading
+import time
+import Queue
+
+from ramcontrol.control import logger
+
+
+class AudioCompressor:
+    """
+    Losslessly compresses finished recordings to FLAC on a low priority
+    background thread, while the next list runs.
+
+    Every compressed recording is appended to a manifest in the session
+    directory (tab separated):
+        recording   original bytes   compressed file   compressed bytes   ms taken
+    """
+
+    MANIFEST = 'compression_manifest.txt'
+
+    def __init__(self, directory, keep_originals=True, niceness=10, encoder='flac'):
+        """
+        :param directory: session directory the recordings are written to
+        :param keep_originals: False to delete each .wav once it is compressed and verified
+        :param niceness: amount to lower the encoder's CPU priority by
+        :param encoder: path to the flac executable
+        """
+        self.directory = directory
+        self.keep_originals = keep_originals
+        self.niceness = niceness
+        self.encoder = encoder
+        self.compressed = 0
+        self.failed = 0
+        self.original_bytes = 0
+        self.compressed_bytes = 0
+        self._disabled = False
+        self._jobs = Queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='AudioCompressor')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, names):
+        """
+        Queues recordings to be compressed
+        :param names: names of the recordings, without .wav
+        """
+        for name in names:
+            self._jobs.put(name)
+
+    def flush(self):
+        """
+        Blocks until all queued recordings have been compressed
+        """
+        self._jobs.join()
+
+    def stats(self):
+        return 'compressed %d recordings (%d failed), %d -> %d bytes' % \
+               (self.compressed, self.failed, self.original_bytes, self.compressed_bytes)
+
+    def _run(self):
+        while True:
+            name = self._jobs.get()
+            try:
+                if not self._disabled:
+                    self._compress(name)
+            except Exception as e:
+                logger.error('Could not compress %s: %s' % (name, e))
+                self.failed += 1
+            finally:
+                self._jobs.task_done()
+
+    def _compress(self, name):
+        wav_path = os.path.join(self.directory, name + '.wav')
+        flac_path = os.path.join(self.directory, name + '.flac')
+        start = time.time()
+        try:
+            returncode = subprocess.call([self.encoder, '--silent', '--best', '--verify', '--force',
+                                          '-o', flac_path, wav_path],
+                                         preexec_fn=lambda: os.nice(self.niceness))
+        except OSError as e:
+            # No encoder, so there is no point trying the rest
+            logger.error('Could not run %s, recordings will not be compressed: %s' % (self.encoder, e))
+            self._disabled = True
+            return
+        if returncode != 0:
+            raise Exception('%s exited with %d' % (self.encoder, returncode))
+
+        original_size = os.path.getsize(wav_path)
+        compressed_size = os.path.getsize(flac_path)
+        manifest = open(os.path.join(self.directory, self.MANIFEST), 'a')
+        manifest.write('%s.wav\t%d\t%s.flac\t%d\t%d\n' %
+                       (name, original_size, name, compressed_size, (time.time() - start) * 1000))
+        manifest.close()
+        if not self.keep_originals:
+            os.remove(wav_path)
+
+        self.compressed += 1
+        self.original_bytes += original_size
+        self.compressed_bytes += compressed_size
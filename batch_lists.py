@@ -0,0 +1,86 @@
+import numpy as np
+
+
+def _permutations(rng, n_rows, n):
+    """
+    Draws an independent permutation of range(n) for each row
+    :return: int array of shape (n_rows, n)
+    """
+    return np.argsort(rng.random_sample((n_rows, n)), axis=1)
+
+
+class BatchLists:
+    """
+    Generates the lists for many sessions at once, as arrays, from a single
+    seeded generator:
+        words:          (sessions, trials, pairs, 2) word pool positions
+        cue_dirs:       (sessions, trials, pairs) 0 or 1, balanced within a session
+        test_orders:    (sessions, trials, pairs) serial positions, alternating even/odd
+        stims:          (sessions, trials) bool
+        practice_words: (sessions, pairs, 2) practice word positions
+    Use to_lists() to get the nested lists stored in the experiment state.
+    """
+
+    def __init__(self, seed, n_sessions, n_trials, n_pairs, pool_size, n_practice_words,
+                 n_baseline_trials=0, n_stim_trials=0, n_control_trials=None):
+        """
+        :param seed: integer seed (0 <= seed < 2**32)
+        :param n_sessions: number of sessions to generate
+        :param n_trials: lists per session
+        :param n_pairs: pairs per list
+        :param pool_size: number of words in the word pool
+        :param n_practice_words: number of words in the practice word pool
+        :param n_baseline_trials: non-stim lists at the start of each session
+        :param n_stim_trials: stim lists per session
+        :param n_control_trials: non-stim lists per session after the baseline
+        """
+        if n_control_trials is None:
+            n_control_trials = n_trials - n_baseline_trials - n_stim_trials
+        assert n_baseline_trials + n_stim_trials + n_control_trials == n_trials
+        assert 2 * n_trials * n_pairs <= pool_size
+        assert 2 * n_pairs <= n_practice_words
+
+        rng = np.random.RandomState(seed)
+        n_lists = n_sessions * n_trials
+        pairs_per_session = n_trials * n_pairs
+
+        self.words = _permutations(rng, n_sessions, pool_size)[:, :2 * pairs_per_session] \
+            .reshape(n_sessions, n_trials, n_pairs, 2)
+
+        balanced_dirs = np.tile([0, 1], pairs_per_session // 2)
+        self.cue_dirs = balanced_dirs[_permutations(rng, n_sessions, len(balanced_dirs))] \
+            .reshape(n_sessions, n_trials, n_pairs)
+
+        self.test_orders = np.empty((n_lists, n_pairs), dtype=int)
+        self.test_orders[:, 0::2] = 2 * _permutations(rng, n_lists, (n_pairs + 1) // 2)
+        self.test_orders[:, 1::2] = 2 * _permutations(rng, n_lists, n_pairs // 2) + 1
+        self.test_orders = self.test_orders.reshape(n_sessions, n_trials, n_pairs)
+
+        # Each half of the non-baseline lists gets half of the stim lists
+        stim_halves = (n_stim_trials // 2, n_stim_trials - n_stim_trials // 2)
+        control_halves = (n_control_trials // 2, n_control_trials - n_control_trials // 2)
+        halves = [np.zeros((n_sessions, n_baseline_trials), dtype=bool)]
+        for n_stim, n_control in zip(stim_halves, control_halves):
+            half = np.arange(n_stim + n_control) < n_stim
+            halves.append(half[_permutations(rng, n_sessions, len(half))])
+        self.stims = np.hstack(halves)
+
+        self.practice_words = _permutations(rng, n_sessions, n_practice_words)[:, :2 * n_pairs] \
+            .reshape(n_sessions, n_pairs, 2)
+
+    def to_lists(self, pool_words, practice_words):
+        """
+        Converts the arrays to the nested lists stored in the experiment state
+        :param pool_words: sequence of words in the word pool
+        :param practice_words: sequence of words in the practice word pool
+        :return: (session_pairs, session_cue_dirs, session_stim, session_test_order, practice_pairs)
+        """
+        session_pairs = [[[(pool_words[w1], pool_words[w2]) for w1, w2 in trial] for trial in session]
+                         for session in self.words.tolist()]
+        practice_pairs = [[(practice_words[w1], practice_words[w2]) for w1, w2 in session]
+                          for session in self.practice_words.tolist()]
+        return (session_pairs,
+                self.cue_dirs.tolist(),
+                self.stims.tolist(),
+                self.test_orders.tolist(),
+                practice_pairs)
@@ -0,0 +1,188 @@
+"""
+Benchmarks subject preparation and per-trial state persistence.
+
+Each combination of the swept parameters runs in its own process, against a
+throwaway data directory and a synthetic word pool, using the headless
+stand-ins for PyEPL. Wall time (best of --repeat runs) is recorded for each
+preparation step, along with the peak memory of the process and the number
+of files written, in a JSON results file.
+
+Usage:
+    python bench_prepare.py [--sessions=18,36] [--trials=25,50] [--pairs=6]
+                            [--pool=300,3000,30000] [--repeat=3]
+                            [--out=bench_results.json]
+"""
+import getopt
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import headless
+
+DEFAULT_SWEEP = {'sessions': [18, 36],
+                 'trials': [25, 50],
+                 'pairs': [6],
+                 'pool': [300, 3000, 30000]}
+
+
+def _timed(function, repeat):
+    """
+    :return: (best wall time in ms, result of the last call)
+    """
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.time()
+        result = function()
+        elapsed = (time.time() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def _count_files(directory):
+    return sum([len(files) for _, _, files in os.walk(directory)])
+
+
+def _peak_memory_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on OS X, kilobytes on linux
+    return peak / 1024 if sys.platform == 'darwin' else peak
+
+
+def _write_words(path, words):
+    word_file = open(path, 'w')
+    word_file.write('\n'.join(words) + '\n')
+    word_file.close()
+
+
+def _make_config(root, n_sessions, n_trials, n_pairs, pool_size):
+    config = headless.HeadlessConfig('config.py', 'PAL1_config.py')
+    config.numSessions = n_sessions
+    config.nTrials = config.nControlTrials = n_trials
+    config.nBaselineTrials = config.nStimTrials = 0
+    config.nPairs = n_pairs
+    config.wp = os.path.join(root, 'wordpool.txt')
+    config.practice_wordList = os.path.join(root, 'practice.txt')
+    _write_words(config.wp, ['W%06d' % i for i in range(pool_size)])
+    _write_words(config.practice_wordList, ['P%03d' % i for i in range(2 * n_pairs)])
+    return config
+
+
+def run_case(params, repeat):
+    """
+    Benchmarks a single combination of parameters
+    :param params: dictionary with sessions, trials, pairs and pool
+    :param repeat: number of times to run each step
+    :return: dictionary of results
+    """
+    headless.install_stubs()
+    import PAL
+
+    root = tempfile.mkdtemp(prefix='pal_bench_')
+    try:
+        config = _make_config(root, params['sessions'], params['trials'], params['pairs'], params['pool'])
+        data_dir = os.path.join(root, 'data')
+        wall_ms = {}
+
+        exp = headless.HeadlessExperiment(data_dir, 'R1000X_bench', config)
+        fr_experiment = PAL.PALExperiment(exp, config, None, None)
+        PAL.Utils.seed_rng('R1000X_bench')
+
+        wall_ms['_copy_word_pool'], _ = _timed(fr_experiment._copy_word_pool, repeat)
+        wall_ms['_prepare_all_sessions_lists'], lists = \
+            _timed(fr_experiment._prepare_all_sessions_lists, repeat)
+        wall_ms['_prepare_practice_lists'], practice_pairs = \
+            _timed(fr_experiment._prepare_practice_lists, repeat)
+        session_pairs = lists[0]
+        wall_ms['_write_lst_files'], _ = \
+            _timed(lambda: fr_experiment._write_lst_files(session_pairs, practice_pairs), repeat)
+
+        # A full initialization needs a subject that has not been started
+        subjects = ['R1000X_init%d' % i for i in range(repeat)]
+
+        def init_next_subject():
+            init_exp = headless.HeadlessExperiment(data_dir, subjects.pop(), config)
+            return PAL.PALExperiment(init_exp, config, None, None).init_experiment()
+        wall_ms['init_experiment'], state = _timed(init_next_subject, repeat)
+
+        # State persistence, against the state of the last initialized subject
+        init_exp = headless.HeadlessExperiment.current
+        init_experiment = PAL.PALExperiment(init_exp, config, None, None)
+        wall_ms['save_state'], _ = _timed(lambda: init_experiment.save_state(state), repeat)
+
+        def save_session_progress():
+            for trial_i in range(config.nTrials):
+                init_experiment.save_progress(state, trialNum=trial_i + 1)
+            init_experiment.journal.flush()
+        wall_ms['save_progress_per_trial'], _ = _timed(save_session_progress, repeat)
+        wall_ms['save_progress_per_trial'] /= config.nTrials
+        wall_ms['restore_state'], _ = _timed(init_experiment.restore_state, repeat)
+
+        return {'params': params,
+                'wall_ms': wall_ms,
+                'peak_memory_kb': _peak_memory_kb(),
+                'files': _count_files(data_dir)}
+    finally:
+        shutil.rmtree(root)
+
+
+def _run_case_in_child(args):
+    return run_case(*args)
+
+
+def sweep(sweep_params, repeat):
+    """
+    Runs every feasible combination of the swept parameters, each in a fresh process
+    :param sweep_params: dictionary of parameter name to list of values
+    :param repeat: number of times to run each step
+    :return: list of results
+    """
+    names = sorted(sweep_params.keys())
+    results = []
+    for values in itertools.product(*[sweep_params[name] for name in names]):
+        params = dict(zip(names, values))
+        if 2 * params['pairs'] * params['trials'] > params['pool']:
+            print 'Skipping %s: word pool is too small' % params
+            continue
+        # maxtasksperchild=1 so peak memory is measured per case
+        pool = multiprocessing.Pool(1, maxtasksperchild=1)
+        try:
+            result = pool.apply(_run_case_in_child, ((params, repeat),))
+        finally:
+            pool.close()
+            pool.join()
+        print '%s\t%s' % (params, ', '.join(['%s=%.1fms' % item for item in sorted(result['wall_ms'].items())]))
+        results.append(result)
+    return results
+
+
+def main(argv):
+    opts, _ = getopt.getopt(argv, '', ['sessions=', 'trials=', 'pairs=', 'pool=', 'repeat=', 'out='])
+    opts = dict(opts)
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    sweep_params = dict(DEFAULT_SWEEP)
+    for name in sweep_params:
+        if '--' + name in opts:
+            sweep_params[name] = [int(value) for value in opts['--' + name].split(',')]
+    repeat = int(opts.get('--repeat', 3))
+
+    results = {'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+               'platform': platform.platform(),
+               'python': platform.python_version(),
+               'repeat': repeat,
+               'cases': sweep(sweep_params, repeat)}
+    out_file = open(opts.get('--out', 'bench_results.json'), 'w')
+    json.dump(results, out_file, indent=2, sort_keys=True)
+    out_file.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
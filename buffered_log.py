@@ -0,0 +1,142 @@
+import atexit
+import unicodedata
+
+from pyepl import timing
+
+from ramcontrol.control import logger
+
+
+class BufferedLog:
+    """
+    Wraps a LogTrack, holding formatted records in memory until flush() is
+    called between trials, or until too many or too old records are held.
+
+    Has the same logMessage() interface as LogTrack, so it can be used
+    anywhere a LogTrack is expected (e.g. as the math log).
+    """
+
+    _open_logs = []
+
+    def __init__(self, log_track, max_records=1000, max_age=300000):
+        """
+        :param log_track: LogTrack that records are written to
+        :param max_records: number of held records that forces a flush
+        :param max_age: time (ms) since the oldest held record was added that forces a flush
+        """
+        self.log_track = log_track
+        self.max_records = max_records
+        self.max_age = max_age
+        self._records = []
+        # Time (ms) the oldest held record was added. Record timestamps can be scheduled in the future.
+        self._oldest_time = None
+        self._folded = {}
+        # (LogTrack, timestamp conversion) that every flushed record is also written to
+        self._mirror = None
+        BufferedLog._open_logs.append(self)
+
+    @staticmethod
+    def remove_accents(text):
+        """
+        :param text: unicode string
+        :return: text folded to ASCII
+        """
+        return unicodedata.normalize('NFKD', text).encode('ascii', 'ignore')
+
+    def fold(self, word):
+        """
+        Folds a word to ASCII, remembering the result for the next time
+        the word is logged
+        :param word: unicode or str word
+        :return: ASCII str
+        """
+        if not isinstance(word, unicode):
+            return word
+        try:
+            return self._folded[word]
+        except KeyError:
+            folded = self._folded[word] = self.remove_accents(word)
+            return folded
+
+    def logMessage(self, message, timestamp=None):
+        """
+        Holds a message to be written on the next flush
+        :param message: the message to be logged
+        :param timestamp: (optional) PresentationClock or (time, latency) tuple
+        """
+        if isinstance(message, unicode):
+            message = self.remove_accents(message)
+        now = timing.now()
+        if timestamp is None:
+            timestamp = (now, 0)
+        elif not isinstance(timestamp, tuple):
+            timestamp = (timestamp.get(), 0)
+        if not self._records:
+            self._oldest_time = now
+        self._records.append((message, timestamp))
+
+        if len(self._records) >= self.max_records or now - self._oldest_time >= self.max_age:
+            self.flush()
+
+    def mirror(self, log_track, convert):
+        """
+        Also writes every flushed record to a second LogTrack, with its
+        timestamp converted, e.g. onto another computer's clock. Conversion
+        happens on flush, so it uses whatever is known by then.
+        :param log_track: LogTrack the converted records are written to
+        :param convert: function((time, latency)) returning the converted timestamp,
+                        or None if the record cannot be converted yet
+        """
+        self._mirror = (log_track, convert)
+
+    def insertMessage(self, message, timestamp):
+        """
+        Holds a message that arrives after later records have been logged,
+        placing it among the held records in timestamp order. Records that
+        have already been written cannot be reordered, so a message older
+        than everything held goes first on the next flush.
+        :param message: the message to be logged
+        :param timestamp: (time, latency) tuple
+        """
+        if isinstance(message, unicode):
+            message = self.remove_accents(message)
+        if not self._records:
+            self._oldest_time = timing.now()
+        i = len(self._records)
+        while i and self._records[i - 1][1][0] > timestamp[0]:
+            i -= 1
+        self._records.insert(i, (message, timestamp))
+
+    def flush(self):
+        """
+        Writes all held records to the log file
+        """
+        records, self._records = self._records, []
+        self._oldest_time = None
+        for message, timestamp in records:
+            self.log_track.logMessage(message, timestamp)
+        if self._mirror:
+            mirror_track, convert = self._mirror
+            n_skipped = 0
+            for message, timestamp in records:
+                converted = convert(timestamp)
+                if converted is None:
+                    n_skipped += 1
+                else:
+                    mirror_track.logMessage(message, converted)
+            if n_skipped:
+                logger.warning('%d log records could not be converted for the mirrored log' % n_skipped)
+        # Not every LogTrack can be flushed; those that cannot write through on logMessage()
+        for log_track in [self.log_track] + ([self._mirror[0]] if self._mirror else []):
+            flush = getattr(log_track, 'flush', None)
+            if flush:
+                flush()
+
+    @classmethod
+    def flush_all(cls):
+        """
+        Flushes every BufferedLog that has been created
+        """
+        for log in cls._open_logs:
+            log.flush()
+
+atexit.register(BufferedLog.flush_all)
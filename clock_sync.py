@@ -0,0 +1,293 @@
+"""
+Estimates the mapping from the task computer's clock to the control PC's
+clock in the background, without pausing the task.
+
+A probe is a timestamped round trip to a clock server (Cristian's
+algorithm): the server's time is taken to be the midpoint of the local
+send and receive times. Probes are repeated, and an offset plus a linear
+drift is fit to them. The slowest round trips are discarded, and so are
+probes that stay far from the fit. The model is refit after each probe,
+but only to the probes of the last few minutes, so a fit costs the same
+however long the session has run and follows changes in drift.
+
+The control PC has to run the clock server; ramcontrol does not provide
+one. It listens on UDP at the configured clockServer address and answers
+each 12 byte request (REQUEST: sequence number, sender's time) with a 20
+byte reply (REPLY: the same sequence number and sender's time, followed by
+its own time in ms), all in network byte order. Its time must come from
+the clock the control PC timestamps its own events with. The stand-in
+server below implements the protocol with the control PC's wall clock
+(time.time()), and can be run there if that is the clock its events use.
+
+To run a stand-in clock server, and to probe one:
+    python clock_sync.py --serve=<port> [--offset=<ms>] [--drift=<ppm>]
+    python clock_sync.py --probe=<host>:<port> [--count=N]
+"""
+import getopt
+import socket
+import struct
+import sys
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from pyepl import timing
+
+from ramcontrol.control import logger
+
+REQUEST = struct.Struct('!Id')      # sequence number, local send time
+REPLY = struct.Struct('!Idd')       # sequence number, local send time, server time
+
+
+class ClockModel:
+    """
+    remote time = local time + offset + drift * (local time - reference)
+    """
+
+    def __init__(self, offset, drift, reference, n_samples, rtt):
+        """
+        :param offset: offset (ms) at the reference time
+        :param drift: change in offset per ms of local time
+        :param reference: local time (ms) the offset is given at
+        :param n_samples: number of probes the model was fit to
+        :param rtt: median round trip time (ms) of those probes
+        """
+        self.offset = offset
+        self.drift = drift
+        self.reference = reference
+        self.n_samples = n_samples
+        self.rtt = rtt
+
+    def to_remote(self, local_time):
+        """
+        :param local_time: time (ms) on the task computer's clock
+        :return: the corresponding time (ms) on the control PC's clock
+        """
+        return local_time + self.offset + self.drift * (local_time - self.reference)
+
+    def describe(self):
+        return 'offset=%.3f ms drift=%.3f ppm reference=%.1f n=%d rtt=%.2f ms' % \
+               (self.offset, self.drift * 1e6, self.reference, self.n_samples, self.rtt)
+
+
+def fit_model(samples, keep_fraction=.5, max_deviation=3.):
+    """
+    :param samples: sequence of (local midpoint, remote time, round trip time), in ms
+    :param keep_fraction: fraction of the samples with the fastest round trips to fit
+    :param max_deviation: residual, in robust standard deviations, beyond which a sample is rejected
+    :return: ClockModel, or None if there are no samples
+    """
+    if not samples:
+        return None
+    samples = np.asarray(samples, dtype=np.float64)
+    local, offsets, rtts = samples[:, 0], samples[:, 1] - samples[:, 0], samples[:, 2]
+
+    # The fastest round trips bound the server's time most tightly
+    if len(samples) >= 8:
+        fast = rtts <= np.percentile(rtts, 100 * keep_fraction)
+        local, offsets, rtts = local[fast], offsets[fast], rtts[fast]
+
+    reference = local.mean()
+    drift = 0.
+    if len(local) >= 3 and local.max() - local.min() > 0:
+        for _ in range(2):
+            drift, offset = np.polyfit(local - reference, offsets, 1)
+            residuals = offsets - (offset + drift * (local - reference))
+            spread = 1.4826 * np.median(np.abs(residuals - np.median(residuals)))
+            inliers = np.abs(residuals) <= max_deviation * spread + 1e-6
+            if inliers.all() or inliers.sum() < 3:
+                break
+            local, offsets, rtts = local[inliers], offsets[inliers], rtts[inliers]
+        offset = np.mean(offsets - drift * (local - reference))
+    else:
+        offset = np.median(offsets)
+    return ClockModel(float(offset), float(drift), float(reference), len(local), float(np.median(rtts)))
+
+
+class UdpTransport:
+    """
+    Exchanges probes with a clock server over UDP
+    """
+
+    def __init__(self, host, port, timeout=.1):
+        self.address = (host, port)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.settimeout(timeout)
+        self._sequence = 0
+
+    def exchange(self, now):
+        """
+        :param now: function returning the local time in ms
+        :return: (local send time, server time, local receive time), or None if there was no reply
+        """
+        self._sequence += 1
+        sent = now()
+        self.socket.sendto(REQUEST.pack(self._sequence, sent), self.address)
+        while True:
+            try:
+                data, _ = self.socket.recvfrom(REPLY.size)
+            except socket.timeout:
+                return None
+            received = now()
+            sequence, echoed, remote = REPLY.unpack(data)
+            # Ignore late replies to earlier probes
+            if sequence == self._sequence and echoed == sent:
+                return sent, remote, received
+
+    def close(self):
+        self.socket.close()
+
+
+class ClockSync:
+    """
+    Probes a clock server from a background thread and keeps the current
+    ClockModel in .model, which can be read at any time without blocking.
+    """
+
+    def __init__(self, transport, interval=1000, burst_size=20, burst_interval=20, window=300000,
+                 max_samples=500):
+        """
+        :param transport: object with exchange(now) and close(), e.g. UdpTransport
+        :param interval: time (ms) between probes
+        :param burst_size: number of probes sent by burst()
+        :param burst_interval: time (ms) between the probes of a burst
+        :param window: time (ms) back from the latest probe that the model is fit over
+        :param max_samples: largest number of probes the model is fit to
+        """
+        self.transport = transport
+        self.interval = interval
+        self.window = window
+        self.burst_size = burst_size
+        self.burst_interval = burst_interval
+        self.model = None
+        self.n_probes = 0
+        self.n_lost = 0
+        self._samples = deque(maxlen=max_samples)
+        self._burst = 0
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """
+        Starts probing
+        :return: self
+        """
+        if not self._running:
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name='ClockSync')
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def burst(self):
+        """
+        Asks for a quick series of probes, e.g. while the task is idle between lists. Does not block.
+        """
+        self._burst = self.burst_size
+        self._wakeup.set()
+
+    def stop(self):
+        if not self._running:
+            return
+        self._running = False
+        self._wakeup.set()
+        self._thread.join(1.)
+        self.transport.close()
+
+    def _run(self):
+        while self._running:
+            try:
+                result = self.transport.exchange(timing.now)
+            except Exception as e:
+                logger.error('Clock probe failed: %s' % e)
+                result = None
+            self.n_probes += 1
+            if result is None:
+                self.n_lost += 1
+            else:
+                sent, remote, received = result
+                self._samples.append(((sent + received) / 2., remote, received - sent))
+                while self._samples[0][0] < self._samples[-1][0] - self.window:
+                    self._samples.popleft()
+                self.model = fit_model(list(self._samples))
+
+            if self._burst > 0:
+                self._burst -= 1
+                wait = self.burst_interval
+            else:
+                wait = self.interval
+            self._wakeup.wait(wait / 1000.)
+            self._wakeup.clear()
+
+
+class StandInServer:
+    """
+    Clock server for testing: replies to each probe with its own time,
+    which runs at an offset from, and drifts away from, this computer's clock.
+    """
+
+    def __init__(self, port, offset=0., drift=0., host='127.0.0.1'):
+        """
+        :param port: UDP port to listen on (0 for any free port)
+        :param offset: offset (ms) of the server's clock
+        :param drift: drift (ppm) of the server's clock
+        """
+        self.offset = offset
+        self.drift = drift / 1e6
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, port))
+        self.address = self.socket.getsockname()
+        self._start = time.time() * 1000
+        self._thread = None
+
+    def now(self):
+        local = time.time() * 1000
+        return local + self.offset + self.drift * (local - self._start)
+
+    def serve_forever(self):
+        while True:
+            data, address = self.socket.recvfrom(REQUEST.size)
+            sequence, sent = REQUEST.unpack(data)
+            self.socket.sendto(REPLY.pack(sequence, sent, self.now()), address)
+
+    def start(self):
+        """
+        Serves from a background thread
+        :return: self
+        """
+        self._thread = threading.Thread(target=self.serve_forever, name='StandInClockServer')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+
+def main(argv):
+    opts, _ = getopt.getopt(argv, '', ['serve=', 'offset=', 'drift=', 'probe=', 'count='])
+    opts = dict(opts)
+    if '--serve' in opts:
+        server = StandInServer(int(opts['--serve']), float(opts.get('--offset', 0)), float(opts.get('--drift', 0)),
+                               host='0.0.0.0')
+        print 'Serving time on UDP port %d' % server.address[1]
+        server.serve_forever()
+    elif '--probe' in opts:
+        host, port = opts['--probe'].split(':')
+        transport = UdpTransport(host, int(port))
+        samples = []
+        for _ in range(int(opts.get('--count', 50))):
+            result = transport.exchange(timing.now)
+            if result:
+                sent, remote, received = result
+                samples.append(((sent + received) / 2., remote, received - sent))
+            time.sleep(.02)
+        model = fit_model(samples)
+        print model.describe() if model else 'No replies'
+    else:
+        print __doc__
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -40,6 +40,44 @@ nPairs = 6
 nTrials = 25
 nSessions = 10
 
+# Make each session's lists only when that session starts,
+# seeded by subject and session number
+lazySessionLists = False
+
+# Draw all sessions' lists at once as numpy arrays (BatchLists),
+# instead of list by list with the random module
+batchListGeneration = False
+
+# Keep words with at least this similarity (0-100: shared onset, shared
+# rhyme or letter overlap) out of the same list. None to disable.
+maxPairSimilarity = None
+similarityCacheDir = 'similarity_cache'
+
+# Record each retrieval period as one continuous file (<trial>_recall.wav),
+# cut into the per-probe <trial>_<probe>.wav files in the background
+continuousRecall = False
+
+# Losslessly compress each finished recording to .flac in the background.
+# Requires the flac encoder.
+compressRecordings = False
+keepUncompressedRecordings = True
+
+# Detect the onset of vocalization in each probe recording in the background,
+# and log it as VOCALIZATION_ONSET relative to the probe
+detectVocalOnsets = False
+# Silence recorded after the mic test to measure the detector's noise floor:
+# delay before recording, and recording length (ms)
+noiseFloorDelay = 500
+noiseFloorDuration = 1000
+
+# (host, port) of a UDP clock server on the control PC (see clock_sync.py
+# for what it must run). When set, the clock offset and drift are estimated
+# in the background and logged as CLOCK_MODEL before each list, and
+# session_remote.log and math_remote.log repeat the logs with times on the
+# control PC's clock. None to disable.
+clockServer = None
+clockProbeInterval = 1000
+
 min_distract = 10000
 
 countdownMovie = 'video_EN/countdown.mpg'
@@ -91,6 +129,10 @@ MATH_incorrectBeepDur = 500
 MATH_incorrectBeepFreq = 200
 MATH_incorrectBeepRF = 50
 MATH_incorrectSndFile = None
+# Draw distractor problems from a seeded bank of distinct problems made
+# when the session starts, instead of generating them as they are shown
+mathProblemBank = False
+MATH_bankSize = 5000
 
 fastConfig = False
 if fastConfig:
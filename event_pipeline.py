@@ -0,0 +1,145 @@
+import threading
+import time
+from collections import deque
+
+from pyepl import timing
+
+from ramcontrol.control import logger
+
+
+class EventPipeline:
+    """
+    Sends messages to the control PC from a background thread, so that
+    socket latency never lands on the presentation thread.
+
+    Sends are queued as callables on a deque, which can be appended to and
+    popped from without taking a lock. Anything that must be timestamped
+    should be stamped by the caller before it is queued.
+    """
+
+    # Message types that are not considered sent until they are delivered
+    FLUSH_TYPES = ('EXIT', 'SESSION')
+
+    _instance = None
+
+    def __init__(self, max_depth=256):
+        """
+        :param max_depth: maximum number of queued messages before put() blocks
+        """
+        self.max_depth = max_depth
+        self._queue = deque()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._running = False
+        # Held while writing to the control PC's socket, which the heartbeat thread also writes to
+        self.send_lock = threading.Lock()
+
+        # Written only by the presentation thread
+        self.enqueued = 0
+        self.overflows = 0
+        self.max_depth_seen = 0
+
+        # Written only by the sender thread
+        self.sent = 0
+        self.errors = 0
+        self.total_latency = 0
+        self.max_latency = 0
+
+    @classmethod
+    def instance(cls):
+        """
+        :return: the EventPipeline shared by the whole process
+        """
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def start(self):
+        """
+        Starts the sender thread
+        """
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='EventPipeline')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, send, *args):
+        """
+        Queues a call to be made on the sender thread
+        :param send: function that sends the message
+        :param args: arguments to send
+        """
+        if not self._running:
+            self.start()
+        if len(self._queue) >= self.max_depth:
+            self.overflows += 1
+            while len(self._queue) >= self.max_depth:
+                time.sleep(.0005)
+        self._queue.append((send, args, timing.now()))
+        self.enqueued += 1
+        self.max_depth_seen = max(self.max_depth_seen, len(self._queue))
+        self._wakeup.set()
+
+    def depth(self):
+        """
+        :return: number of messages waiting to be sent
+        """
+        return len(self._queue)
+
+    def flush(self, timeout=5.):
+        """
+        Blocks until every queued message has been sent
+        :param timeout: maximum number of seconds to wait
+        :return: True if the queue was emptied
+        """
+        end_time = time.time() + timeout
+        while self.sent + self.errors < self.enqueued:
+            if not self._running or time.time() > end_time:
+                return False
+            time.sleep(.001)
+        return True
+
+    def shutdown(self):
+        """
+        Sends everything still queued, then stops the sender thread
+        """
+        if not self._running:
+            return
+        if not self.flush():
+            logger.error('%d control PC messages were not sent' % self.depth())
+        self._running = False
+        self._wakeup.set()
+        self._thread.join(1.)
+
+    def stats(self):
+        """
+        :return: dictionary of queue depth and send latency counters
+        """
+        n_done = self.sent + self.errors
+        return dict(depth=self.depth(),
+                    max_depth=self.max_depth_seen,
+                    enqueued=self.enqueued,
+                    sent=self.sent,
+                    errors=self.errors,
+                    overflows=self.overflows,
+                    mean_latency=float(self.total_latency) / n_done if n_done else 0.,
+                    max_latency=self.max_latency)
+
+    def _run(self):
+        while self._running:
+            self._wakeup.wait(.1)
+            self._wakeup.clear()
+            while self._queue:
+                send, args, enqueue_time = self._queue.popleft()
+                try:
+                    with self.send_lock:
+                        send(*args)
+                    self.sent += 1
+                except Exception as e:
+                    self.errors += 1
+                    logger.error('Could not send message to control PC: %s' % e)
+                latency = timing.now() - enqueue_time
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
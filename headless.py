@@ -0,0 +1,760 @@
+"""
+Runs PAL sessions without a display, audio device, keyboard or control PC.
+
+PyEPL and RAMControl are replaced by stand-ins driven by a virtual clock,
+which jumps straight to the next scheduled time instead of waiting for it.
+Prompts are answered by scripted key presses. A full session runs in
+seconds, and the CPU time spent in each phase of the task is reported.
+
+Usage:
+    python headless.py [--sconfig=PAL1_config.py] [--lists=N] [--subject=CODE]
+                       [--json=results.json] [--keep] [--check-resume]
+
+With --check-resume, a session is crashed part way through and restarted,
+and the restarted session is checked to continue from the journaled trial.
+"""
+import getopt
+import json
+import logging
+import os
+import pickle
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import types
+import wave
+from collections import deque
+
+import numpy as np
+
+logger = logging.getLogger('headless')
+logger.addHandler(logging.NullHandler())
+
+RESPONSE_TIME = 500
+MATH_RESPONSE_TIME = 2000
+MOVIE_DURATION = 10000
+RECORDING_RATE = 8000
+VOCAL_ONSET = 1200
+SPEECH_DURATION = 800
+
+
+class VirtualTime:
+    """
+    The current (virtual) time in ms. Never moves unless something waits.
+    """
+    now = 0
+
+    @classmethod
+    def advance_to(cls, t):
+        cls.now = max(cls.now, t)
+
+
+def now():
+    return VirtualTime.now
+
+
+class PresentationClock:
+
+    def __init__(self):
+        self.time = VirtualTime.now
+
+    def get(self):
+        return self.time
+
+    def delay(self, milliseconds=0, jitter=0):
+        self.time += milliseconds + (random.randint(0, jitter) if jitter else 0)
+
+    def wait(self):
+        VirtualTime.advance_to(self.time)
+
+    def tare(self):
+        self.time = max(self.time, VirtualTime.now)
+
+
+def _time_of(clock):
+    return clock.get() if clock else VirtualTime.now
+
+
+class ScriptedKeys:
+    """
+    Key presses given to the task, in order. When a script runs out (or the
+    next scripted key is not accepted), the first accepted key is pressed.
+    """
+    script = deque()
+
+    @classmethod
+    def press(cls, keys):
+        if cls.script and cls.script[0] in [key.name for key in keys]:
+            name = cls.script.popleft()
+            return [key for key in keys if key.name == name][0]
+        return keys[0]
+
+
+class Key:
+
+    def __init__(self, name):
+        self.name = name
+
+    def __eq__(self, other):
+        return isinstance(other, Key) and other.name == self.name
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __and__(self, other):
+        return Key('%s AND %s' % (self.name, other.name))
+
+
+class ButtonChooser:
+
+    def __init__(self, *keys):
+        self.keys = keys or (Key('ANY'),)
+
+    def waitWithTime(self, minDuration=None, maxDuration=None, clock=None):
+        clock = clock or PresentationClock()
+        clock.delay(RESPONSE_TIME)
+        clock.wait()
+        return ScriptedKeys.press(self.keys), (clock.get(), 0)
+
+    def wait(self, clock=None):
+        return self.waitWithTime(clock=clock)[0]
+
+
+class Shown:
+
+    def __init__(self, showable):
+        self.showable = showable
+
+
+class VideoTrack:
+    _last = None
+
+    def __init__(self, name):
+        self.name = name
+        self.update_callbacks = []
+        self.shown = []
+        self.n_updates = 0
+        VideoTrack._last = self
+
+    @classmethod
+    def lastInstance(cls):
+        return cls._last
+
+    def clear(self, color=None):
+        self.shown = []
+
+    def showCentered(self, showable):
+        handle = Shown(showable)
+        self.shown.append(handle)
+        return handle
+
+    def showAnchored(self, showable, anchor=None, position=None):
+        return self.showCentered(showable)
+
+    def unshow(self, handle):
+        if handle in self.shown:
+            self.shown.remove(handle)
+
+    def propToPixel(self, x, y):
+        return x, y
+
+    def addUpdateCallback(self, callback):
+        self.update_callbacks.append(callback)
+
+    def removeUpdateCallback(self, callback):
+        self.update_callbacks.remove(callback)
+
+    def updateScreen(self, clock=None):
+        t = _time_of(clock)
+        VirtualTime.advance_to(t)
+        self.n_updates += 1
+        if self.shown:
+            _cue_times.append(t)
+        for callback in self.update_callbacks[:]:
+            callback(t)
+        return t, 0
+
+    def playMovie(self, movie):
+        # PyEPL shows the first frame on its next screen update
+        self.updateScreen()
+
+    def stopMovie(self, movie):
+        pass
+
+
+class Showable:
+
+    def __init__(self, text='', size=None, *args, **kwargs):
+        self.text = text
+        self.size = size
+        self.loaded = False
+
+    def load(self):
+        self.loaded = True
+
+    def unload(self):
+        self.loaded = False
+
+    def present(self, clk=None, duration=None, bc=None, *args, **kwargs):
+        video = VideoTrack.lastInstance()
+        clk = clk or PresentationClock()
+        handle = video.showCentered(self)
+        timestamp = video.updateScreen(clk)
+        button, bc_time = None, None
+        if bc:
+            button, bc_time = bc.waitWithTime(clock=clk)
+        elif duration:
+            clk.delay(duration)
+        video.unshow(handle)
+        video.updateScreen(clk)
+        return timestamp, button, bc_time
+
+
+class Text(Showable):
+    pass
+
+
+class CustomText(Showable):
+
+    def presentWithCallback(self, clk=None, duration=None, updateCallback=None):
+        video = VideoTrack.lastInstance()
+        if updateCallback:
+            video.addUpdateCallback(updateCallback)
+        handle = video.showCentered(self)
+        timestamp_on = video.updateScreen(clk)
+        clk.delay(duration)
+        video.unshow(handle)
+        timestamp_off = video.updateScreen(clk)
+        if updateCallback:
+            video.removeUpdateCallback(updateCallback)
+        return timestamp_on, timestamp_off
+
+
+class Movie(Showable):
+
+    def getTotalTime(self):
+        return MOVIE_DURATION
+
+    def rewind(self):
+        pass
+
+
+class CustomBeep:
+
+    def __init__(self, freq, duration, rise_fall):
+        self.duration = duration
+
+    def present(self, clock=None):
+        timestamp = (_time_of(clock), 0)
+        if clock:
+            clock.delay(self.duration)
+        return timestamp
+
+
+class LogTrack:
+
+    def __init__(self, name):
+        self.log_file = HeadlessExperiment.current.session.createFile('%s.log' % name)
+
+    def logMessage(self, message, timestamp=None):
+        if timestamp is None:
+            timestamp = (VirtualTime.now, 0)
+        elif not isinstance(timestamp, tuple):
+            timestamp = (timestamp.get(), 0)
+        self.log_file.write('%d\t%d\t%s\n' % (timestamp[0], timestamp[1], message))
+
+    def flush(self):
+        self.log_file.flush()
+
+
+# Times of the screen updates that showed something, which the subject answers
+_cue_times = []
+_noise = []
+_t = np.arange(SPEECH_DURATION * RECORDING_RATE / 1000) / float(RECORDING_RATE)
+_speech = 8000 * np.sin(2 * np.pi * 150 * _t) * np.minimum(1, _t * 50) * np.minimum(1, (_t[-1] - _t) * 50)
+
+
+def _recording_samples(start, end):
+    """
+    Noise is made once and sliced, so that writing recordings costs little
+    CPU time next to the task itself
+    :return: frames of a recording from start to end (ms), with a burst of speech
+             VOCAL_ONSET ms after each cue shown while it was recording
+    """
+    n_frames = max(0, end - start) * RECORDING_RATE / 1000
+    if not _noise or len(_noise[0]) < n_frames:
+        _noise[:] = [np.random.RandomState(0).normal(0, 30, max(n_frames, 60 * RECORDING_RATE))]
+    samples = _noise[0][:n_frames].copy()
+    for cue_time in _cue_times:
+        if start <= cue_time < end:
+            onset = (cue_time + VOCAL_ONSET - start) * RECORDING_RATE / 1000
+            burst = samples[onset:onset + len(_speech)]
+            burst += _speech[:len(burst)]
+    return samples.astype('<i2').tostring()
+
+
+class CustomAudioTrack:
+    """
+    Writes recordings of quiet noise into the session directory, with a
+    burst of "speech" VOCAL_ONSET ms after each cue shown while recording.
+    A recording started on the same screen update as its cue starts VOCAL_ONSET
+    ms before the speech.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.recordings = []
+        self._recording = None
+
+    def startRecording(self, filename, t=None):
+        self.recordings.append(filename)
+        self._recording = (filename, _time_of(t))
+        return None, (_time_of(t), 0)
+
+    def stopRecording(self, t=None):
+        filename, start = self._recording
+        recording = wave.open(os.path.join(HeadlessExperiment.current.session.fullPath(),
+                                           filename + '.wav'), 'wb')
+        recording.setparams((1, 2, RECORDING_RATE, 0, 'NONE', 'not compressed'))
+        recording.writeframes(_recording_samples(start, _time_of(t)))
+        recording.close()
+        self._recording = None
+        return None, (_time_of(t), 0)
+
+
+class KeyTrack:
+
+    def __init__(self, name):
+        self.name = name
+
+
+def waitForAnyKey(clk, showable=None, *args, **kwargs):
+    return Text().present(clk, bc=ButtonChooser())[0]
+
+
+def waitForAnyKeyWithCallback(clk, showable=None, onscreenCallback=None, offscreenCallback=None):
+    if onscreenCallback:
+        onscreenCallback()
+    timestamp = waitForAnyKey(clk, showable)
+    if offscreenCallback:
+        offscreenCallback()
+    return timestamp
+
+
+def flashStimulusWithOffscreenTimestamp(showable, clk=None, duration=None):
+    video = VideoTrack.lastInstance()
+    handle = video.showCentered(showable)
+    timestamp_on = video.updateScreen(clk)
+    clk.delay(duration)
+    video.unshow(handle)
+    timestamp_off = video.updateScreen(clk)
+    return timestamp_on, timestamp_off
+
+
+def flashStimulus(showable, duration=1000, clk=None):
+    return showable.present(clk, duration)
+
+
+def customMathDistract(clk=None, mathlog=None, numVars=3, maxProbs=500, plusAndMinus=False,
+                       minDuration=20000, textSize=None, callback=None, *args, **kwargs):
+    # Logs in the same format as PyEPL's math distractor: START, one PROB line per problem, STOP
+    start = clk.get()
+    mathlog.logMessage('START', clk)
+    n_probs = 0
+    while clk.get() - start < minDuration and n_probs < maxProbs:
+        nums = [random.randint(1, 9) for _ in range(numVars)]
+        problem = '%s = ' % ' + '.join([str(n) for n in nums])
+        answer = str(sum(nums))
+        problem_time = (clk.get(), 0)
+        clk.delay(MATH_RESPONSE_TIME)
+        clk.wait()
+        mathlog.logMessage('PROB\t%r\t%r\t%s\t%d' % (problem, answer, True, MATH_RESPONSE_TIME), problem_time)
+        if callback:
+            callback(problem, answer, True, MATH_RESPONSE_TIME)
+        n_probs += 1
+    mathlog.logMessage('STOP', clk)
+
+
+def customMicTest(duration=2000, threshold=1.0):
+    return True
+
+
+def instruct(text, *args, **kwargs):
+    pass
+
+
+def checkVersion(version):
+    pass
+
+
+class RAMControl:
+    _instance = None
+
+    def __init__(self):
+        self.socket = types.ModuleType('socket')
+        self.sent = []
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def build_message(self, type, *args, **kwargs):
+        return type, args, kwargs
+
+    def send(self, message):
+        self.sent.append(message)
+
+    def send_math_message(self, *args, **kwargs):
+        self.sent.append(('MATH', args, kwargs))
+
+    def align_clocks(self, *args, **kwargs):
+        pass
+
+    def register_handler(self, *args):
+        pass
+
+
+class WordMessage:
+
+    def __init__(self, word):
+        self.word = word
+
+
+SOUTH = 'SOUTH'
+EAST = 'EAST'
+WEST = 'WEST'
+STUB_NAMES = ['Key', 'ButtonChooser', 'VideoTrack', 'Text', 'CustomText', 'Movie', 'CustomBeep',
+              'LogTrack', 'CustomAudioTrack', 'KeyTrack', 'PresentationClock', 'waitForAnyKey',
+              'waitForAnyKeyWithCallback', 'flashStimulusWithOffscreenTimestamp', 'flashStimulus',
+              'customMathDistract', 'customMicTest', 'instruct', 'checkVersion', 'SOUTH', 'EAST',
+              'WEST']
+
+
+def install_stubs():
+    """
+    Replaces the pyepl and ramcontrol modules with the stand-ins above.
+    Must be called before PAL is imported.
+    """
+    this_module = sys.modules[__name__]
+
+    def make_module(name, **attributes):
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        sys.modules[name] = module
+        return module
+
+    stubs = dict((name, getattr(this_module, name)) for name in STUB_NAMES)
+    timing = make_module('pyepl.timing', now=now)
+    make_module('pyepl', timing=timing, locals=make_module('pyepl.locals', **stubs))
+    make_module('ramcontrol',
+                extendedPyepl=make_module('ramcontrol.extendedPyepl', **stubs),
+                control=make_module('ramcontrol.control', RAMControl=RAMControl,
+                                    logger=logger),
+                messages=make_module('ramcontrol.messages', WordMessage=WordMessage))
+
+
+class HeadlessState:
+    pass
+
+
+class HeadlessSession:
+
+    def __init__(self, subject_dir):
+        self.subject_dir = subject_dir
+        self.number = 0
+
+    def fullPath(self):
+        path = os.path.join(self.subject_dir, 'session_%d' % self.number)
+        if not os.path.exists(path):
+            os.makedirs(path)
+        return path
+
+    def createFile(self, name):
+        return open(os.path.join(self.fullPath(), name), 'w')
+
+
+class HeadlessExperiment:
+    """
+    Stand-in for pyepl's Experiment, keeping its data in a directory of its own
+    """
+    current = None
+
+    def __init__(self, data_dir, subject, config):
+        self.subject = subject
+        self.config = config
+        self.session = HeadlessSession(os.path.join(data_dir, subject))
+        self._state_path = os.path.join(self.session.subject_dir, 'state.pkl')
+        HeadlessExperiment.current = self
+
+    def getOptions(self):
+        return {'subject': self.subject}
+
+    def getConfig(self):
+        return self.config
+
+    def setSession(self, number):
+        self.session.number = number
+
+    def saveState(self, state, **kwargs):
+        state = state or HeadlessState()
+        for key, value in kwargs.items():
+            setattr(state, key, value)
+        state_file = open(self._state_path, 'wb')
+        pickle.dump(state, state_file, 2)
+        state_file.close()
+
+    def restoreState(self):
+        if not os.path.exists(self._state_path):
+            return None
+        return pickle.load(open(self._state_path, 'rb'))
+
+
+class HeadlessConfig:
+
+    def __init__(self, *filenames):
+        namespace = {}
+        for filename in filenames:
+            execfile(filename, namespace)
+        for key, value in namespace.items():
+            if not key.startswith('__'):
+                setattr(self, key, value)
+
+
+class PhaseTimer:
+    """
+    Accumulates CPU time per phase. Time spent in a phase nested inside
+    another (e.g. a continuous distractor during encoding) is only counted
+    for the inner phase.
+    """
+
+    def __init__(self):
+        self.cpu_time = {}
+        self.calls = {}
+        self._stack = []
+
+    @staticmethod
+    def _cpu():
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime
+
+    def wrap(self, phase, method):
+        def timed(*args, **kwargs):
+            self._enter(phase)
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self._exit()
+        return timed
+
+    def _enter(self, phase):
+        now_cpu = self._cpu()
+        if self._stack:
+            self._charge(self._stack[-1][0], now_cpu - self._stack[-1][1])
+        self._stack.append([phase, now_cpu])
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+
+    def _exit(self):
+        now_cpu = self._cpu()
+        phase, start = self._stack.pop()
+        self._charge(phase, now_cpu - start)
+        if self._stack:
+            self._stack[-1][1] = now_cpu
+
+    def _charge(self, phase, seconds):
+        self.cpu_time[phase] = self.cpu_time.get(phase, 0.) + seconds
+
+
+PHASES = (('encoding', '_present_pair'),
+          ('distractor', '_do_distractor'),
+          ('retrieval', '_run_recall'))
+
+
+def headless_config(sconfig, n_lists=None):
+    """
+    :param sconfig: experiment-specific config file
+    :param n_lists: (optional) number of lists per session
+    :return: config with everything that needs a person or a control PC turned off
+    """
+    config = HeadlessConfig('config.py', sconfig)
+    config.show_video = False
+    config.show_instruct_text = False
+    config.control_pc = False
+    if n_lists:
+        config.nTrials = n_lists
+        config.nBaselineTrials = 0
+        config.nStimTrials = n_lists / 2 if config.do_stim else 0
+        config.nControlTrials = n_lists - config.nStimTrials
+    return config
+
+
+def simulate(sconfig='PAL1_config.py', n_lists=None, subject='R1000X_headless', data_dir=None):
+    """
+    Prepares and runs one full session headlessly
+    :param sconfig: experiment-specific config file
+    :param n_lists: (optional) number of lists per session
+    :param subject: subject code, used to seed the lists
+    :param data_dir: (optional) directory to write data to
+    :return: dictionary of results
+    """
+    install_stubs()
+    import PAL
+
+    config = headless_config(sconfig, n_lists)
+
+    exp = HeadlessExperiment(data_dir, subject, config)
+    video = VideoTrack('video')
+    clock = PresentationClock()
+    timer = PhaseTimer()
+    start_cpu = timer._cpu()
+
+    fr_experiment = PAL.PALExperiment(exp, config, video, clock)
+    if not fr_experiment.is_experiment_started():
+        fr_experiment.init_experiment()
+    prepare_cpu = timer._cpu() - start_cpu
+
+    runner = PAL.PALExperimentRunner(fr_experiment, clock,
+                                     PAL.BufferedLog(LogTrack('session')),
+                                     PAL.BufferedLog(LogTrack('math')),
+                                     video, CustomAudioTrack('audio'))
+    for phase, method_name in PHASES:
+        setattr(runner, method_name, timer.wrap(phase, getattr(runner, method_name)))
+
+    start_virtual = VirtualTime.now
+    session_cpu = timer._cpu()
+    runner.run_session(KeyTrack('keyboard'))
+    session_cpu = timer._cpu() - session_cpu
+    PAL.cleanup_ram_control()
+
+    n_run = config.nTrials + 1  # Including the practice list
+    phases = dict((phase, {'cpu_ms': timer.cpu_time.get(phase, 0.) * 1000,
+                           'calls': timer.calls.get(phase, 0)})
+                  for phase, _ in PHASES)
+    return {'sconfig': sconfig,
+            'lists': n_run,
+            'prepare_cpu_ms': prepare_cpu * 1000,
+            'session_cpu_ms': session_cpu * 1000,
+            'other_cpu_ms': (session_cpu - sum(timer.cpu_time.values())) * 1000,
+            'virtual_session_ms': VirtualTime.now - start_virtual,
+            'screen_updates': video.n_updates,
+            'phases': phases}
+
+
+class SimulatedCrash(Exception):
+    pass
+
+
+def _count_lists(runner, counts, crash_after=None):
+    """
+    Counts the practice and experimental lists a runner starts, optionally
+    crashing instead of starting the list after crash_after experimental lists
+    """
+    run_list = runner._run_list
+
+    def counted(*args, **kwargs):
+        kind = 'practice' if kwargs.get('is_practice') else 'lists'
+        if kind == 'lists' and counts['lists'] == crash_after:
+            raise SimulatedCrash()
+        counts[kind] += 1
+        return run_list(*args, **kwargs)
+    runner._run_list = counted
+
+
+def check_resume(sconfig='PAL1_config.py', n_lists=4, crash_after=2, subject='R1000X_headless', data_dir=None):
+    """
+    Crashes a session after crash_after lists, restarts the experiment the
+    way PAL.run() does, and runs the session to the end
+    :return: list of problems found; empty if the session resumed from the journaled trial
+    """
+    install_stubs()
+    import PAL
+
+    config = headless_config(sconfig, n_lists)
+    problems = []
+
+    def start(counts, crash=None):
+        exp = HeadlessExperiment(data_dir, subject, config)
+        fr_experiment = PAL.PALExperiment(exp, config, VideoTrack('video'), PresentationClock())
+        state = PAL.restore_or_init_state(fr_experiment)
+        runner = PAL.PALExperimentRunner(fr_experiment, PresentationClock(), LogTrack('session'),
+                                         LogTrack('math'), VideoTrack.lastInstance(), CustomAudioTrack('audio'))
+        _count_lists(runner, counts, crash)
+        return exp, fr_experiment, state, runner
+
+    counts = {'practice': 0, 'lists': 0}
+    _, fr_experiment, _, runner = start(counts, crash_after)
+    try:
+        runner.run_session(KeyTrack('keyboard'))
+        problems.append('session did not crash')
+    except SimulatedCrash:
+        # Progress the journal thread wrote before the crash
+        fr_experiment.journal.flush()
+
+    resumed = {'practice': 0, 'lists': 0}
+    exp, _, state, runner = start(resumed)
+    if exp.restoreState().trialNum != 0:
+        problems.append('progress was saved in the full state, so the journal was not needed')
+    if state.trialNum != crash_after:
+        problems.append('restored trialNum %d, expected %d' % (state.trialNum, crash_after))
+    if not state.session_started:
+        problems.append('restored state does not show the session as started')
+    runner.run_session(KeyTrack('keyboard'))
+    PAL.cleanup_ram_control()
+    if resumed['practice']:
+        problems.append('practice list was run again')
+    if resumed['lists'] != n_lists - crash_after:
+        problems.append('resumed session ran %d lists, expected %d' % (resumed['lists'], n_lists - crash_after))
+    return problems
+
+
+def print_results(results):
+    print 'Headless session: %(sconfig)s, %(lists)d lists (%(virtual_session_ms)d ms of task time)' % results
+    print '\tpreparation\t%8.1f ms CPU' % results['prepare_cpu_ms']
+    print '\tsession\t\t%8.1f ms CPU' % results['session_cpu_ms']
+    for phase, _ in PHASES:
+        phase_results = results['phases'][phase]
+        print '\t%-10s\t%8.1f ms CPU\t(%.2f ms per call, %d calls)' % \
+              (phase, phase_results['cpu_ms'],
+               phase_results['cpu_ms'] / phase_results['calls'] if phase_results['calls'] else 0,
+               phase_results['calls'])
+    print '\tother\t\t%8.1f ms CPU' % results['other_cpu_ms']
+
+
+def main(argv):
+    opts, _ = getopt.getopt(argv, '', ['sconfig=', 'lists=', 'subject=', 'json=', 'keep', 'check-resume'])
+    opts = dict(opts)
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    data_dir = tempfile.mkdtemp(prefix='pal_headless_')
+    if '--check-resume' in opts:
+        try:
+            problems = check_resume(sconfig=opts.get('--sconfig', 'PAL1_config.py'),
+                                    subject=opts.get('--subject', 'R1000X_headless'),
+                                    data_dir=data_dir)
+        finally:
+            shutil.rmtree(data_dir)
+        for problem in problems:
+            print 'Resume failed: %s' % problem
+        if problems:
+            sys.exit(1)
+        print 'Resumed from the journaled trial'
+        return
+    try:
+        results = simulate(sconfig=opts.get('--sconfig', 'PAL1_config.py'),
+                           n_lists=int(opts['--lists']) if '--lists' in opts else None,
+                           subject=opts.get('--subject', 'R1000X_headless'),
+                           data_dir=data_dir)
+    finally:
+        if '--keep' in opts:
+            print 'Session data kept in %s' % data_dir
+        else:
+            shutil.rmtree(data_dir)
+    print_results(results)
+    if '--json' in opts:
+        json.dump(results, open(opts['--json'], 'w'), indent=2)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
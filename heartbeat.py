@@ -0,0 +1,146 @@
+import threading
+import time
+from array import array
+
+from ramcontrol.control import logger
+
+
+class Heartbeat:
+    """
+    Sends heartbeats to the control PC from a thread of its own, on a fixed
+    schedule, and measures how much they are delayed by contention for the
+    connection.
+
+    Heartbeats are written to the same ramcontrol connection as every other
+    control message, under a lock the event pipeline holds while it sends,
+    so a control message whose send stalls delays the next heartbeat. The
+    time spent waiting for the lock is recorded separately from the send
+    itself, so the report shows how often that happens and for how long.
+
+    Each heartbeat's lateness (wakeup - scheduled time), lock wait and send
+    time are recorded. A heartbeat that is not sent within half an interval
+    of its scheduled time counts as a missed deadline; if a whole interval
+    is lost, the skipped heartbeats count as missed too.
+    """
+
+    PERCENTILES = (50, 90, 95, 99)
+
+    _instance = None
+
+    def __init__(self, capacity=8192):
+        """
+        :param capacity: number of heartbeats whose timing is kept
+        """
+        self.capacity = capacity
+        self.interval = None
+        self.sent = 0
+        self.missed = 0
+        self.skipped = 0
+        self.errors = 0
+        self._lateness = array('d', [0] * capacity)
+        self._lock_wait = array('d', [0] * capacity)
+        self._send_time = array('d', [0] * capacity)
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def instance(cls):
+        """
+        :return: the Heartbeat shared by the whole process
+        """
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, send, interval, lock=None):
+        """
+        Starts sending heartbeats
+        :param send: function that sends one heartbeat
+        :param interval: time (ms) between heartbeats
+        :param lock: (optional) lock held by anything else that writes to the same connection
+        """
+        if self.is_running():
+            return
+        self.interval = interval
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(send, lock or threading.Lock()), name='Heartbeat')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if not self.is_running():
+            return
+        self._stop.set()
+        self._thread.join(1.)
+
+    def _run(self, send, lock):
+        interval = self.interval / 1000.
+        scheduled = time.time()
+        while not self._stop.is_set():
+            now = time.time()
+            if now < scheduled:
+                if self._stop.wait(scheduled - now):
+                    break
+            lateness = (time.time() - scheduled) * 1000
+
+            start = time.time()
+            lock.acquire()
+            locked = time.time()
+            try:
+                send()
+            except Exception as e:
+                self.errors += 1
+                logger.error('Could not send heartbeat: %s' % e)
+            finally:
+                lock.release()
+            sent = time.time()
+            lock_wait = (locked - start) * 1000
+            send_time = (sent - locked) * 1000
+            i = self.sent % self.capacity
+            self._lateness[i] = lateness
+            self._lock_wait[i] = lock_wait
+            self._send_time[i] = send_time
+            self.sent += 1
+            if lateness + lock_wait + send_time > self.interval / 2.:
+                self.missed += 1
+
+            # Keep to the original schedule, skipping any heartbeats that can no longer be on time
+            scheduled += interval
+            behind = int((time.time() - scheduled) / interval)
+            if behind > 0:
+                scheduled += behind * interval
+                self.skipped += behind
+                self.missed += behind
+
+    @staticmethod
+    def _describe(values, percentiles):
+        values = sorted(values)
+        ranks = [values[int(round(p / 100. * (len(values) - 1)))] for p in percentiles]
+        return 'mean=%.2f %s max=%.2f' % (sum(values) / len(values),
+                                          ' '.join(['p%d=%.2f' % (p, value) for p, value in zip(percentiles, ranks)]),
+                                          values[-1])
+
+    def report(self):
+        """
+        :return: text report of heartbeat timing
+        """
+        n = min(self.sent, self.capacity)
+        lines = ['Heartbeats every %s ms: %d sent, %d missed deadlines (%d skipped), %d send errors' %
+                 (self.interval, self.sent, self.missed, self.skipped, self.errors)]
+        if n:
+            lines.append('Lateness (ms): %s' % self._describe(self._lateness[:n], self.PERCENTILES))
+            lines.append('Wait for shared connection (ms): %s' %
+                         self._describe(self._lock_wait[:n], self.PERCENTILES))
+            lines.append('Send time (ms): %s' % self._describe(self._send_time[:n], self.PERCENTILES))
+        return '\n'.join(lines) + '\n'
+
+    def write_report(self, report_file):
+        """
+        Writes the report and closes the file
+        :param report_file: open file object
+        """
+        report_file.write(self.report())
+        report_file.close()
@@ -0,0 +1,111 @@
+"""
+Packs the .lst files of a session into a single indexed file.
+
+Bundle layout:
+    LSTBUNDLE 1
+    <label>\t<offset>\t<length>      (one line per .lst file)
+    <blank line>
+    <body>
+
+Offsets are relative to the start of the body. Labels with identical
+contents share the same bytes in the body.
+
+To write out the individual .lst files from a bundle:
+    python list_bundle.py <bundle file> [<output directory>]
+"""
+import os
+import sys
+
+MAGIC = 'LSTBUNDLE 1'
+
+
+def pack(entries):
+    """
+    Packs list files into the bundle format
+    :param entries: sequence of (label, contents) pairs, contents as str
+    :return: the bundle as a str
+    """
+    index = []
+    body = []
+    offsets = {}
+    body_length = 0
+    for label, contents in entries:
+        if contents not in offsets:
+            offsets[contents] = body_length
+            body.append(contents)
+            body_length += len(contents)
+        index.append('%s\t%d\t%d' % (label, offsets[contents], len(contents)))
+    return '\n'.join([MAGIC] + index + ['', '']) + ''.join(body)
+
+
+def write_bundle(bundle_file, entries):
+    """
+    Writes a bundle in a single write
+    :param bundle_file: open file object to write to
+    :param entries: sequence of (label, contents) pairs, contents as str
+    """
+    bundle_file.write(pack(entries))
+    bundle_file.close()
+
+
+class ListBundle:
+    """
+    Read access to the .lst files packed in a bundle
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path to the bundle file
+        """
+        self.path = path
+        data = open(path, 'rb').read()
+        header_end = data.index('\n\n') + 2
+        lines = data[:header_end].splitlines()
+        if not lines or lines[0] != MAGIC:
+            raise Exception('%s is not a list bundle' % path)
+        self._body = data[header_end:]
+        self._index = {}
+        self._labels = []
+        for line in lines[1:]:
+            if not line:
+                continue
+            label, offset, length = line.split('\t')
+            self._index[label] = (int(offset), int(length))
+            self._labels.append(label)
+
+    def labels(self):
+        """
+        :return: the names of the packed files, in the order they were written
+        """
+        return self._labels[:]
+
+    def __contains__(self, label):
+        return label in self._index
+
+    def read(self, label):
+        """
+        :param label: name of the .lst file, e.g. '3_0.lst'
+        :return: contents of the file
+        """
+        offset, length = self._index[label]
+        return self._body[offset:offset + length]
+
+    def materialize(self, directory, labels=None):
+        """
+        Writes the packed files out as individual .lst files
+        :param directory: directory to write the files to
+        :param labels: (optional) the files to write. Defaults to all of them.
+        """
+        for label in labels or self._labels:
+            lst_file = open(os.path.join(directory, label), 'wb')
+            lst_file.write(self.read(label))
+            lst_file.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        print __doc__
+        sys.exit(1)
+    bundle_path = sys.argv[1]
+    output_dir = sys.argv[2] if len(sys.argv) == 3 else os.path.dirname(os.path.abspath(bundle_path))
+    ListBundle(bundle_path).materialize(output_dir)
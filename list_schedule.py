@@ -0,0 +1,134 @@
+"""
+Compiles a list into a precomputed schedule: every jittered delay is drawn,
+and every log line and control PC word message is formatted, before the
+list starts. The runner then only walks the schedule.
+
+Schedules are saved next to the session logs (schedule_<trial>.json) so
+the timeline of each list can be audited, or loaded and run again.
+"""
+import json
+import random
+from collections import namedtuple
+
+VERSION = 1
+
+# One study pair: orientation, pre-encoding delay, then the pair
+StudyStep = namedtuple('StudyStep', ['pair_i', 'pre_delay', 'study_log', 'word_message'])
+# One test probe: pre-cue delay, then the probe and its recording
+ProbeStep = namedtuple('ProbeStep', ['probe_i', 'pair_i', 'pre_delay', 'probe_log', 'filename'])
+
+
+class ListSchedule:
+    """
+    The precomputed timeline of a single list
+    """
+
+    def __init__(self, label, is_practice, is_stim, timing, logs, study_steps, probe_steps):
+        """
+        :param label: list label used in log lines and recording names ('p' for practice)
+        :param is_practice: True for the practice list
+        :param is_stim: True for stim lists
+        :param timing: {name: duration in ms} of the fixed durations of the list
+        :param logs: {name: log line} of the log lines that are the same for every pair
+        :param study_steps: list of StudyStep
+        :param probe_steps: list of ProbeStep
+        """
+        self.label = label
+        self.is_practice = is_practice
+        self.is_stim = is_stim
+        self.timing = timing
+        self.logs = logs
+        self.study_steps = study_steps
+        self.probe_steps = probe_steps
+
+    def duration(self):
+        """
+        :return: scheduled time (ms) of encoding and retrieval, excluding
+                 the distractor and the time taken by the screen and recorder
+        """
+        timing = self.timing
+        encoding = sum([timing['orientation'] + step.pre_delay + timing['encoding_duration'] +
+                        timing['post_pair'] for step in self.study_steps])
+        retrieval = sum([step.pre_delay + timing['cue_duration'] + timing['post_cue']
+                         for step in self.probe_steps])
+        return encoding + retrieval
+
+    def save(self, schedule_file):
+        """
+        Writes the schedule as JSON and closes the file
+        :param schedule_file: open file object
+        """
+        json.dump({'version': VERSION,
+                   'label': self.label,
+                   'is_practice': self.is_practice,
+                   'is_stim': self.is_stim,
+                   'timing': self.timing,
+                   'logs': self.logs,
+                   'study_steps': self.study_steps,
+                   'probe_steps': self.probe_steps},
+                  schedule_file, indent=1)
+        schedule_file.close()
+
+    @classmethod
+    def load(cls, path):
+        """
+        :param path: path to a saved schedule
+        :return: ListSchedule object
+        """
+        saved = json.load(open(path))
+        if saved['version'] != VERSION:
+            raise Exception('%s is a version %s schedule' % (path, saved['version']))
+        return cls(str(saved['label']), saved['is_practice'], saved['is_stim'], saved['timing'],
+                   dict((name, str(line)) for name, line in saved['logs'].items()),
+                   [StudyStep(step[0], step[1], str(step[2]), step[3]) for step in saved['study_steps']],
+                   [ProbeStep(step[0], step[1], step[2], str(step[3]), str(step[4]))
+                    for step in saved['probe_steps']])
+
+
+def compile_list(config, pair_list, cue_dirs, rec_order, label, fold,
+                 is_stim=False, is_practice=False, rng=random):
+    """
+    :param config: experiment config
+    :param pair_list: the list's word pairs
+    :param cue_dirs: cue direction of each probe, in test order
+    :param rec_order: serial position of each probe, in test order
+    :param label: list label ('p' for practice)
+    :param fold: function folding a word to the ASCII form written to the log
+    :param is_stim: True for stim lists
+    :param is_practice: True for the practice list
+    :param rng: (optional) random.Random instance to draw jitter from. Defaults to the random module.
+    :return: ListSchedule object
+    """
+    list_type = 'STUDY_' if not is_practice else 'PRACTICE_'
+    timing = {'orientation': config.encoding_orientation,
+              'encoding_duration': config.encoding_duration,
+              # Time after each pair, before the next pair's orientation
+              'post_pair': config.post_cue,
+              'cue_duration': config.cue_duration,
+              'post_cue': config.post_cue}
+    logs = {'orient': '%sORIENT' % list_type,
+            'orient_off': '%sORIENT_OFF' % list_type,
+            'pair_off': 'PAIR_OFF' if not is_practice else 'PRACTICE_PAIR_OFF'}
+
+    study_steps = []
+    for pair_i, pair in enumerate(pair_list):
+        word1, word2 = fold(pair[0]), fold(pair[1])
+        if not is_practice:
+            study_log = 'STUDY_PAIR\t%d\tTRIAL_%s\tWORD1_%s\tWORD2_%s\t%s' % \
+                        (pair_i, label, word1, word2, 'STIM' if is_stim else 'NO_STIM')
+        else:
+            study_log = 'PRACTICE_PAIR\t%d\tWORD1_%s\tWORD2_%s' % (pair_i, word1, word2)
+        pre_delay = config.pre_encoding_delay + \
+            (rng.randint(0, config.pre_encoding_jitter) if config.pre_encoding_jitter else 0)
+        study_steps.append(StudyStep(pair_i, pre_delay, study_log, '{}-{}'.format(pair[0], pair[1])))
+
+    probe_steps = []
+    for probe_i, (pair_i, cue_dir) in enumerate(zip(rec_order, cue_dirs)):
+        pair = pair_list[pair_i]
+        probe_log = 'TEST_PROBE\t%d\tSP_%d\tTRIAL_%s\tPROBE_%s\tEXPECTING_%s\tDIRECTION_%d' % \
+                    (probe_i, pair_i, label, fold(pair[cue_dir]), fold(pair[(cue_dir + 1) % 2]), cue_dir)
+        pre_delay = config.cue_orientation + config.pre_cue + \
+            (rng.randint(0, config.pre_cue_jitter) if config.pre_cue_jitter else 0)
+        probe_steps.append(ProbeStep(probe_i, pair_i, pre_delay, probe_log, '%s_%d' % (label, probe_i)))
+
+    return ListSchedule(label, is_practice, is_stim, timing, logs, study_steps, probe_steps)
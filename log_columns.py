@@ -0,0 +1,438 @@
+"""
+Converts a session's session.log and math.log into a single columnar file
+(session.palcol) that opens as memory-mapped numpy arrays, without parsing.
+
+File layout:
+    PALCOLUMNS 1 <header length>\\n
+    <JSON header>                     (tables, columns, dtypes and offsets)
+    <padding to 8 bytes>
+    <column data>                     (each column 8-byte aligned)
+
+Text fields (words, event types, untyped fields) are stored once in a string
+dictionary and referred to by int32 codes. Missing values are -1.
+
+events table (session.log):
+    mstime, msoffset, type
+    serialpos   study serial position (STUDY_PAIR, PRACTICE_PAIR, TEST_PROBE)
+    probepos    test position (TEST_PROBE, VOCALIZATION_ONSET, NO_VOCALIZATION)
+    trial       list number (TRIAL, STUDY_PAIR, TEST_PROBE). Practice is -1.
+    word1       WORD1 / PROBE
+    word2       WORD2 / EXPECTING
+    direction   cue direction of TEST_PROBE
+    stim        1 for stim lists, 0 for non-stim lists
+    value       MOVIE_FIRST_FRAME and STIM_PREBUILD times, VOCALIZATION_ONSET latency
+    fields      remaining fields of events without typed columns
+
+math table (math.log):
+    mstime, msoffset, type, problem, response, correct, rt
+
+To convert sessions:
+    python log_columns.py <session dir> [<session dir> ...]
+    python log_columns.py --recursive <data dir>
+
+To check that made-up logs read back unchanged from their columnar file:
+    python log_columns.py --self-test
+"""
+import ast
+import json
+import os
+import shutil
+import sys
+import tempfile
+from array import array
+
+import numpy as np
+
+MAGIC = 'PALCOLUMNS 1'
+ALIGNMENT = 8
+FILENAME = 'session.palcol'
+
+EVENT_COLUMNS = (('mstime', 'd', '<i8'), ('msoffset', 'i', '<i4'), ('type', 'i', '<i4'),
+                 ('serialpos', 'h', '<i2'), ('probepos', 'h', '<i2'), ('trial', 'h', '<i2'),
+                 ('word1', 'i', '<i4'), ('word2', 'i', '<i4'), ('direction', 'b', 'i1'),
+                 ('stim', 'b', 'i1'), ('value', 'i', '<i4'), ('fields', 'i', '<i4'))
+MATH_COLUMNS = (('mstime', 'd', '<i8'), ('msoffset', 'i', '<i4'), ('type', 'i', '<i4'),
+                ('problem', 'i', '<i4'), ('response', 'i', '<i4'), ('correct', 'b', 'i1'),
+                ('rt', 'i', '<i4'))
+
+STIM_VALUES = {'STIM': 1, 'NO_STIM': 0, 'NONSTIM': 0}
+
+
+class StringDictionary:
+    """
+    Assigns int32 codes to strings, in order of first appearance
+    """
+
+    def __init__(self):
+        self.codes = {}
+        self.strings = []
+
+    def code(self, string):
+        if string not in self.codes:
+            self.codes[string] = len(self.strings)
+            self.strings.append(string)
+        return self.codes[string]
+
+
+def _prefixed(field, prefix):
+    return field[len(prefix):] if field.startswith(prefix) else None
+
+
+def _int(text):
+    try:
+        return int(text)
+    except (TypeError, ValueError):
+        return -1
+
+
+def _trial(text):
+    # Practice lists are labelled 'p'
+    return -1 if text in (None, 'p') else _int(text)
+
+
+def _parse_event(fields, strings):
+    """
+    :param fields: tab separated fields of a session.log line, after the timestamp
+    :return: values of EVENT_COLUMNS, without mstime and msoffset
+    """
+    event_type = fields[0]
+    serialpos = probepos = trial = word1 = word2 = direction = stim = value = rest = -1
+    args = fields[1:]
+
+    if event_type in ('STUDY_PAIR', 'PRACTICE_PAIR') and len(args) >= 3:
+        serialpos = _int(args[0])
+        if event_type == 'STUDY_PAIR':
+            trial = _trial(_prefixed(args[1], 'TRIAL_'))
+            stim = STIM_VALUES.get(args[4], -1) if len(args) > 4 else -1
+            args = args[1:]
+        word1 = strings.code(_prefixed(args[1], 'WORD1_') or '')
+        word2 = strings.code(_prefixed(args[2], 'WORD2_') or '')
+    elif event_type == 'TEST_PROBE' and len(args) >= 6:
+        probepos = _int(args[0])
+        serialpos = _int(_prefixed(args[1], 'SP_'))
+        trial = _trial(_prefixed(args[2], 'TRIAL_'))
+        word1 = strings.code(_prefixed(args[3], 'PROBE_') or '')
+        word2 = strings.code(_prefixed(args[4], 'EXPECTING_') or '')
+        direction = _int(_prefixed(args[5], 'DIRECTION_'))
+    elif event_type == 'TRIAL' and len(args) >= 2:
+        trial = _int(args[0])
+        stim = STIM_VALUES.get(args[1], -1)
+    elif event_type in ('VOCALIZATION_ONSET', 'NO_VOCALIZATION') and args:
+        probepos = _int(args[0])
+        if event_type == 'VOCALIZATION_ONSET' and len(args) >= 3:
+            value = _int(args[2])
+    elif event_type in ('MOVIE_FIRST_FRAME', 'STIM_PREBUILD') and args:
+        value = _int(args[0])
+    elif args:
+        rest = strings.code('\t'.join(args))
+    return (strings.code(event_type), serialpos, probepos, trial, word1, word2, direction, stim, value, rest)
+
+
+def _parse_math(fields, strings):
+    """
+    :param fields: tab separated fields of a math.log line, after the timestamp
+    :return: values of MATH_COLUMNS, without mstime and msoffset
+    """
+    problem = response = correct = rt = -1
+    if fields[0] == 'PROB' and len(fields) >= 5:
+        try:
+            problem = strings.code(ast.literal_eval(fields[1]))
+            response = strings.code(ast.literal_eval(fields[2]))
+        except (ValueError, SyntaxError):
+            problem = strings.code(fields[1])
+            response = strings.code(fields[2])
+        correct = {'True': 1, 'False': 0}.get(fields[3], _int(fields[3]))
+        rt = _int(fields[4])
+    return strings.code(fields[0]), problem, response, correct, rt
+
+
+def _read_table(path, columns, parse, strings):
+    """
+    Streams a log file into one array per column
+    :return: list of (name, dtype, array) for each column
+    """
+    arrays = [array(typecode) for _, typecode, _ in columns]
+    if os.path.exists(path):
+        for line in open(path, 'rb'):
+            fields = line.rstrip('\r\n').split('\t')
+            if len(fields) < 3:
+                continue
+            mstime, msoffset = _int(fields[0]), _int(fields[1])
+            for column, value in zip(arrays, (mstime, msoffset) + parse(fields[2:], strings)):
+                column.append(value)
+    return [(name, dtype, values) for (name, _, dtype), values in zip(columns, arrays)]
+
+
+def _padding(length):
+    return '\0' * (-length % ALIGNMENT)
+
+
+def write_columns(out_path, tables, strings):
+    """
+    Writes tables of columns and their string dictionary to a file
+    :param out_path: file to write
+    :param tables: list of (table name, list of (column name, dtype, array))
+    :param strings: sequence of str
+    """
+    header = {'tables': {}, 'table_order': [name for name, _ in tables]}
+
+    # Lay out the column data, with offsets relative to the end of the header
+    layout = []
+    length = 0
+    for table_name, columns in tables:
+        table = {'rows': len(columns[0][2]) if columns else 0, 'columns': []}
+        for column_name, dtype, values in columns:
+            data = np.frombuffer(values.tostring(), dtype=values.typecode).astype(dtype).tostring()
+            table['columns'].append([column_name, dtype, length])
+            layout.append(data + _padding(len(data)))
+            length += len(layout[-1])
+        header['tables'][table_name] = table
+
+    string_data = ''.join(strings)
+    string_offsets = np.cumsum([0] + [len(string) for string in strings]).astype('<i8').tostring()
+    header['strings'] = {'count': len(strings), 'offsets': length, 'data': length + len(string_offsets),
+                         'data_length': len(string_data)}
+    layout.append(string_offsets)
+    layout.append(string_data)
+
+    header_json = json.dumps(header)
+    first_line = '%s %d\n' % (MAGIC, len(header_json))
+    preamble = first_line + header_json
+    out_file = open(out_path + '.tmp', 'wb')
+    out_file.write(preamble + _padding(len(preamble)))
+    for block in layout:
+        out_file.write(block)
+    out_file.close()
+    os.rename(out_path + '.tmp', out_path)
+
+
+def convert_session(session_dir, out_path=None):
+    """
+    Converts a session's session.log and math.log
+    :param session_dir: directory containing session.log and (optionally) math.log
+    :param out_path: (optional) file to write. Defaults to session.palcol in session_dir.
+    :return: path of the written file
+    """
+    out_path = out_path or os.path.join(session_dir, FILENAME)
+    strings = StringDictionary()
+    events = _read_table(os.path.join(session_dir, 'session.log'), EVENT_COLUMNS, _parse_event, strings)
+    math = _read_table(os.path.join(session_dir, 'math.log'), MATH_COLUMNS, _parse_math, strings)
+    write_columns(out_path, [('events', events), ('math', math)], strings.strings)
+    return out_path
+
+
+def is_up_to_date(session_dir):
+    """
+    :return: True if the session's columnar file is newer than its logs
+    """
+    out_path = os.path.join(session_dir, FILENAME)
+    if not os.path.exists(out_path):
+        return False
+    logs = [os.path.join(session_dir, name) for name in ('session.log', 'math.log')]
+    return all([os.path.getmtime(out_path) >= os.path.getmtime(log) for log in logs if os.path.exists(log)])
+
+
+class Table:
+    """
+    Columns of a table, as read-only numpy arrays backed by the mapped file
+    """
+
+    def __init__(self, name, rows, columns):
+        self.name = name
+        self.rows = rows
+        self.columns = columns
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, column_name):
+        return self.columns[column_name]
+
+    def column_names(self):
+        return self.columns.keys()
+
+
+class ColumnFile:
+    """
+    Read access to a columnar log file. Opening it maps the file; no data is
+    read until it is used.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path to the .palcol file
+        """
+        self.path = path
+        header_file = open(path, 'rb')
+        first_line = header_file.readline()
+        if not first_line.startswith(MAGIC + ' '):
+            raise Exception('%s is not a columnar log file' % path)
+        header_json = header_file.read(int(first_line[len(MAGIC) + 1:]))
+        header_file.close()
+        header = json.loads(header_json)
+        data_start = len(first_line) + len(header_json)
+        data_start += -data_start % ALIGNMENT
+
+        self._data = np.memmap(path, dtype=np.uint8, mode='r')
+        self.tables = {}
+        for table_name in header['table_order']:
+            table = header['tables'][table_name]
+            columns = {}
+            for column_name, dtype, offset in table['columns']:
+                dtype = np.dtype(str(dtype))
+                start = data_start + offset
+                columns[column_name] = self._data[start:start + table['rows'] * dtype.itemsize].view(dtype)
+            self.tables[table_name] = Table(table_name, table['rows'], columns)
+
+        strings = header['strings']
+        offsets_start = data_start + strings['offsets']
+        self._string_offsets = self._data[offsets_start:offsets_start + 8 * (strings['count'] + 1)].view('<i8')
+        data_start = data_start + strings['data']
+        self._string_data = self._data[data_start:data_start + strings['data_length']]
+        self._codes = None
+
+    def __getitem__(self, table_name):
+        return self.tables[table_name]
+
+    def string(self, code):
+        """
+        :param code: string dictionary code
+        :return: the string, or None for -1
+        """
+        if code < 0:
+            return None
+        return self._string_data[self._string_offsets[code]:self._string_offsets[code + 1]].tostring()
+
+    def decode(self, codes):
+        """
+        :param codes: sequence of string dictionary codes
+        :return: list of strings (None for -1)
+        """
+        return [self.string(code) for code in codes]
+
+    def code(self, string):
+        """
+        :param string: string to look up
+        :return: its dictionary code, or -1 if it does not occur in the file
+        """
+        if self._codes is None:
+            self._codes = dict((self.string(code), code) for code in range(len(self._string_offsets) - 1))
+        return self._codes.get(string, -1)
+
+    def rows_of_type(self, table_name, event_type):
+        """
+        :return: boolean mask of the rows of a table with the given type
+        """
+        return self.tables[table_name]['type'] == self.code(event_type)
+
+
+# (session.log line, values of its typed columns other than -1), for check_round_trip()
+CHECK_EVENTS = (
+    ('1000\t0\tSESS_START\t1\tNO_STIM_SESSION\tv_2.0', {'fields': '1\tNO_STIM_SESSION\tv_2.0'}),
+    ('1500\t0\tPRACTICE_TRIAL', {}),
+    ('2000\t1\tPRACTICE_PAIR\t0\tWORD1_WATCH\tWORD2_TONGUE', {'serialpos': 0, 'word1': 'WATCH', 'word2': 'TONGUE'}),
+    ('3000\t0\tTEST_PROBE\t2\tSP_1\tTRIAL_p\tPROBE_WATCH\tEXPECTING_TONGUE\tDIRECTION_1',
+     {'probepos': 2, 'serialpos': 1, 'word1': 'WATCH', 'word2': 'TONGUE', 'direction': 1}),
+    ('4200\t0\tVOCALIZATION_ONSET\t2\tp_2\t1200', {'probepos': 2, 'value': 1200}),
+    ('5000\t0\tNO_VOCALIZATION\t3\tp_3', {'probepos': 3}),
+    ('6000\t0\tTRIAL\t1\tSTIM', {'trial': 1, 'stim': 1}),
+    ('7000\t0\tSTUDY_PAIR\t0\tTRIAL_1\tWORD1_SPONGE\tWORD2_POOL\tNO_STIM',
+     {'serialpos': 0, 'trial': 1, 'word1': 'SPONGE', 'word2': 'POOL', 'stim': 0}),
+    ('8000\t0\tTEST_PROBE\t0\tSP_0\tTRIAL_1\tPROBE_POOL\tEXPECTING_SPONGE\tDIRECTION_0',
+     {'probepos': 0, 'serialpos': 0, 'trial': 1, 'word1': 'POOL', 'word2': 'SPONGE', 'direction': 0}),
+    ('9000\t0\tMOVIE_FIRST_FRAME\t35', {'value': 35}),
+    # Times on the control PC's clock do not fit in 32 bits
+    ('1792334436633\t0\tREC_START\tp_recall', {'fields': 'p_recall'}),
+)
+# (math.log line, values of its typed columns other than -1)
+CHECK_MATH = (
+    ('46955\t0\tSTART', {}),
+    ("46955\t0\tPROB\t'6 + 8 + 8 = '\t'22'\tTrue\t1500",
+     {'problem': '6 + 8 + 8 = ', 'response': '22', 'correct': 1, 'rt': 1500}),
+    ("48955\t0\tPROB\t'3 + 9 + 7 = '\t'009'\tFalse\t2000",
+     {'problem': '3 + 9 + 7 = ', 'response': '009', 'correct': 0, 'rt': 2000}),
+    ('60000\t0\tSTOP', {}),
+)
+
+
+def _check_table(column_file, table_name, columns, cases, string_columns):
+    """
+    :return: list of differences between a table and the log lines it was converted from
+    """
+    table = column_file[table_name]
+    if len(table) != len(cases):
+        return ['%s table has %d rows, expected %d' % (table_name, len(table), len(cases))]
+    problems = []
+    for row, (line, expected) in enumerate(cases):
+        fields = line.split('\t')
+        expected = dict(expected, mstime=int(fields[0]), msoffset=int(fields[1]), type=fields[2])
+        for column_name, _, _ in columns:
+            value = table[column_name][row]
+            if column_name in string_columns:
+                value = column_file.string(value)
+            wanted = expected.get(column_name, None if column_name in string_columns else -1)
+            if value != wanted:
+                problems.append('%s row %d (%s): %s is %r, expected %r' %
+                                (table_name, row, fields[2], column_name, value, wanted))
+    return problems
+
+
+def check_round_trip():
+    """
+    Converts made-up logs, with a practice list, math rows, a malformed line
+    and empty logs, and checks every value read back from the columnar files
+    :return: list of problems found; empty if everything read back unchanged
+    """
+    directory = tempfile.mkdtemp(prefix='palcol_check_')
+    try:
+        session_dir = os.path.join(directory, 'session')
+        os.mkdir(session_dir)
+        open(os.path.join(session_dir, 'session.log'), 'wb').write(
+            '\n'.join([line for line, _ in CHECK_EVENTS] + ['malformed']) + '\n')
+        open(os.path.join(session_dir, 'math.log'), 'wb').write('\n'.join([line for line, _ in CHECK_MATH]) + '\n')
+        column_file = ColumnFile(convert_session(session_dir))
+        problems = _check_table(column_file, 'events', EVENT_COLUMNS, CHECK_EVENTS,
+                                ('type', 'word1', 'word2', 'fields'))
+        problems += _check_table(column_file, 'math', MATH_COLUMNS, CHECK_MATH, ('type', 'problem', 'response'))
+
+        # An empty session.log, and no math.log at all
+        empty_dir = os.path.join(directory, 'empty')
+        os.mkdir(empty_dir)
+        open(os.path.join(empty_dir, 'session.log'), 'wb').close()
+        column_file = ColumnFile(convert_session(empty_dir))
+        for table_name, columns in (('events', EVENT_COLUMNS), ('math', MATH_COLUMNS)):
+            problems += _check_table(column_file, table_name, columns, (), ())
+            if sorted(column_file[table_name].column_names()) != sorted([name for name, _, _ in columns]):
+                problems.append('empty %s table is missing columns' % table_name)
+        return problems
+    finally:
+        shutil.rmtree(directory)
+
+
+def main(argv):
+    if not argv:
+        print __doc__
+        sys.exit(1)
+    if argv[0] == '--self-test':
+        problems = check_round_trip()
+        for problem in problems:
+            print 'Round trip failed: %s' % problem
+        if problems:
+            sys.exit(1)
+        print 'Events, math rows and empty logs read back unchanged'
+        return
+    if argv[0] == '--recursive':
+        session_dirs = [directory for root in argv[1:] for directory, _, files in os.walk(root)
+                        if 'session.log' in files]
+    else:
+        session_dirs = argv
+    for session_dir in session_dirs:
+        if is_up_to_date(session_dir):
+            continue
+        out_path = convert_session(session_dir)
+        column_file = ColumnFile(out_path)
+        print '%s: %d events, %d math rows' % (out_path, len(column_file['events']), len(column_file['math']))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
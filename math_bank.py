@@ -0,0 +1,80 @@
+import numpy as np
+
+
+class MathBank:
+    """
+    A seeded bank of distinct arithmetic problems, generated once when the
+    session starts:
+        operands:  (n_problems, num_vars) int8
+        signs:     (n_problems, num_vars - 1) int8, +1 or -1
+        answers:   (n_problems,) int16, never negative
+    The problem and answer texts are formatted up front, so a typed answer
+    is checked by comparing strings.
+    """
+
+    def __init__(self, seed, n_problems, num_vars=3, min_num=1, max_num=9, plus_and_minus=False):
+        """
+        :param seed: integer seed (0 <= seed < 2**32)
+        :param n_problems: number of problems wanted. Fewer are made if there are not that many distinct problems.
+        :param num_vars: operands per problem
+        :param min_num: smallest operand
+        :param max_num: largest operand
+        :param plus_and_minus: True to use subtraction as well as addition
+        """
+        rng = np.random.RandomState(seed)
+        n_signs = 2 ** (num_vars - 1) if plus_and_minus else 1
+        n_possible = (max_num - min_num + 1) ** num_vars * n_signs
+
+        operands = np.empty((0, num_vars), dtype=np.int8)
+        signs = np.empty((0, num_vars - 1), dtype=np.int8)
+        n_wanted = min(n_problems, n_possible)
+        n_draw = n_wanted
+        # Redraw with more candidates until there are enough distinct, non-negative problems
+        while True:
+            operands = rng.randint(min_num, max_num + 1, (n_draw, num_vars)).astype(np.int8)
+            if plus_and_minus:
+                signs = rng.choice(np.array([-1, 1], dtype=np.int8), (n_draw, num_vars - 1))
+            else:
+                signs = np.ones((n_draw, num_vars - 1), dtype=np.int8)
+            answers = operands[:, 0].astype(np.int16) + (operands[:, 1:] * signs).sum(axis=1, dtype=np.int16)
+            keep = answers >= 0
+            rows = np.hstack((operands, signs))[keep]
+            _, first = np.unique(rows, axis=0, return_index=True)
+            first = np.flatnonzero(keep)[np.sort(first)]
+            if len(first) >= n_wanted or n_draw >= 20 * n_possible:
+                break
+            n_draw *= 2
+
+        first = first[:n_wanted]
+        self.operands = operands[first]
+        self.signs = signs[first]
+        self.answers = answers[first]
+
+        self.texts = []
+        for problem_operands, problem_signs in zip(self.operands.tolist(), self.signs.tolist()):
+            terms = [str(problem_operands[0])]
+            for operand, sign in zip(problem_operands[1:], problem_signs):
+                terms.append('%s %d' % ('+' if sign > 0 else '-', operand))
+            self.texts.append(' '.join(terms) + ' = ')
+        self.answer_texts = [str(answer) for answer in self.answers.tolist()]
+        self.max_answer_length = max([len(answer) for answer in self.answer_texts]) if self.answer_texts else 0
+        self._next = 0
+
+    def __len__(self):
+        return len(self.texts)
+
+    def next_problem(self):
+        """
+        :return: index of the next problem, starting again from the first once all have been used
+        """
+        problem_i = self._next
+        self._next = (self._next + 1) % len(self.texts)
+        return problem_i
+
+    def is_correct(self, problem_i, typed):
+        """
+        :param problem_i: index of the problem
+        :param typed: answer typed by the subject
+        :return: True if the answer is correct
+        """
+        return bool(typed) and (typed.lstrip('0') or '0') == self.answer_texts[problem_i]
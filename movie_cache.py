@@ -0,0 +1,134 @@
+from pyepl import timing
+from pyepl.locals import Movie
+
+from ramcontrol.control import logger
+
+
+class MovieCache:
+    """
+    Keeps decoded movies in memory so that each movie file is only loaded
+    once per process. At most max_movies are held at a time; the least
+    recently played movie is unloaded to make room for a new one.
+
+    Between playbacks a movie is rewound, either by the Movie itself or by
+    the pygame movie it decodes with. A movie that can be rewound neither way
+    is dropped from the cache and loaded again, which is logged as a warning.
+    """
+
+    _instance = None
+
+    def __init__(self, max_movies=2):
+        """
+        :param max_movies: number of decoded movies to keep in memory
+        """
+        self.max_movies = max_movies
+        self._movies = {}
+        self._recently_used = []
+        self.start_latencies = {}
+        self.reloads = 0
+        # Playing Movie -> (movie file, start time, update callback, [first frame time])
+        self._playing = {}
+
+    @classmethod
+    def instance(cls):
+        """
+        :return: the MovieCache shared by the whole process
+        """
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def get(self, movie_file):
+        """
+        Gets the decoded movie for a file, loading it if it is not cached
+        :param movie_file: path to the movie file
+        :return: loaded Movie object, at its first frame
+        """
+        if movie_file in self._movies:
+            self._recently_used.remove(movie_file)
+        else:
+            movie_object = Movie(movie_file)
+            movie_object.load()
+            self._movies[movie_file] = movie_object
+            while len(self._movies) > self.max_movies:
+                self._movies.pop(self._recently_used.pop(0)).unload()
+        self._recently_used.append(movie_file)
+        return self._movies[movie_file]
+
+    def start(self, video, movie_file):
+        """
+        Starts playing a movie centered on the screen. The time of the first
+        screen update that shows it is taken by an update callback, and is
+        returned by stop().
+        :param video: VideoTrack object
+        :param movie_file: path to the movie file
+        :return: (movie_object, shown_handle)
+        """
+        start_time = timing.now()
+        movie_object = self.get(movie_file)
+        first_frame = []
+
+        def on_update(*_):
+            if not first_frame:
+                first_frame.append(timing.now())
+        video.addUpdateCallback(on_update)
+        self._playing[movie_object] = (movie_file, start_time, on_update, first_frame)
+        movie_shown = video.showCentered(movie_object)
+        video.playMovie(movie_object)
+        return movie_object, movie_shown
+
+    def stop(self, video, movie_object, movie_shown):
+        """
+        Stops a movie started with start() and rewinds it for the next playback.
+        Movies that cannot be rewound are dropped from the cache, so they are
+        loaded again from the start next time.
+        :param video: VideoTrack object
+        :param movie_object: Movie returned by start()
+        :param movie_shown: shown handle returned by start()
+        :return: (start time, first frame latency, rewound). The latency (ms) is from start()
+                 to the first screen update that showed the movie, or None if there was none.
+                 rewound is False if the movie was dropped from the cache.
+        """
+        video.stopMovie(movie_object)
+        video.unshow(movie_shown)
+        movie_file, start_time, on_update, first_frame = self._playing.pop(movie_object)
+        video.removeUpdateCallback(on_update)
+        latency = first_frame[0] - start_time if first_frame else None
+        if latency is not None:
+            self.start_latencies.setdefault(movie_file, []).append(latency)
+            logger.info('%s first shown after %d ms' % (movie_file, latency))
+
+        if self._rewind(movie_object):
+            return start_time, latency, True
+        logger.warning('%s cannot be rewound; it will be loaded again next time' % movie_file)
+        self.reloads += 1
+        if self._movies.get(movie_file) is movie_object:
+            del self._movies[movie_file]
+            self._recently_used.remove(movie_file)
+        movie_object.unload()
+        return start_time, latency, False
+
+    @staticmethod
+    def _rewind(movie_object):
+        """
+        :return: True if the movie was set back to its first frame
+        """
+        if hasattr(movie_object, 'rewind'):
+            movie_object.rewind()
+            return True
+        # pygame movies start playing again when rewound
+        decoded = getattr(movie_object, 'movie', None)
+        if hasattr(decoded, 'rewind') and hasattr(decoded, 'stop'):
+            decoded.rewind()
+            decoded.stop()
+            return True
+        return False
+
+    def clear(self):
+        """
+        Unloads all cached movies
+        """
+        for movie_object in self._movies.values():
+            movie_object.unload()
+        self._movies = {}
+        self._recently_used = []
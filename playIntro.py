@@ -1,5 +1,6 @@
 from pyepl.locals import *
 import os, shutil
+from movie_cache import MovieCache
 
 def playIntro(exp, video, audio, keyboard, allowSkip, language):
     """
@@ -53,12 +54,10 @@ def playWholeMovie(video, audio, movieFile, audioFile, clock, bc = None):
     """
     Plays any movie file and audio file synchronously
     """
-    movieObject = Movie(movieFile)
-    movieObject.load()
+    movieCache = MovieCache.instance()
+    (movieObject, shown) = movieCache.start(video, movieFile)
     #sound = FileAudioClip(audioFile)
    # sound.load()
-    video.showCentered(movieObject)
-    video.playMovie(movieObject)
     #audio.play(sound)
     # Stop on button press if BC passed in, otherwise wait until the movie
     # is finished.
@@ -69,8 +68,7 @@ def playWholeMovie(video, audio, movieFile, audioFile, clock, bc = None):
         clock.wait()
         bc.wait()
     #audio.playStop()
-    video.stopMovie(movieObject)
-    movieObject.unload()
+    movieCache.stop(video, movieObject, shown)
 
 
 
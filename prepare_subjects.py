@@ -0,0 +1,97 @@
+"""
+Prepares subjects ahead of time, so that no lists have to be made while
+the patient is in the room.
+
+For each subject code, the full plan, the .lst bundles and (optionally) the
+stim forms are written into the archive directory, exactly where
+run_PAL1/run_PAL3 will look for them. With lazySessionLists on, every
+session's lists are still made here. Subjects are prepared in parallel,
+one process per subject. Subjects that have already been started are left
+untouched.
+
+Usage (from the experiment directory):
+    python prepare_subjects.py --sconfig=PAL1_config.py --archive=<data dir>
+                               [--config=config.py] [--forms] [--processes=N]
+                               SUBJECT [SUBJECT ...]
+"""
+import getopt
+import multiprocessing
+import sys
+import time
+import traceback
+
+
+def prepare_subject(args):
+    """
+    Prepares a single subject. Runs in a worker process.
+    :param args: (subject, config_file, sconfig_file, archive_dir, make_forms)
+    :return: (subject, status message, time taken in ms)
+    """
+    subject, config_file, sconfig_file, archive_dir, make_forms = args
+    start = time.time()
+    try:
+        from pyepl.locals import Experiment
+        import PAL
+
+        # Parse the same options run_PAL* passes to PAL.py
+        sys.argv = ['PAL.py', '-s', subject, '--config=%s' % config_file,
+                    '--sconfig=%s' % sconfig_file, '--archive=%s' % archive_dir]
+        exp = Experiment(use_eeg=False)
+        exp.parseArgs()
+        exp.setup()
+        exp.setSession(0)
+
+        fr_experiment = PAL.PALExperiment(exp, exp.getConfig(), None, None)
+        if fr_experiment.is_experiment_started():
+            status = 'already prepared'
+        else:
+            state = fr_experiment.init_experiment()
+            if fr_experiment.config.lazySessionLists:
+                # Preparing ahead is the point, so every session's lists are made now
+                fr_experiment.prepare_all_sessions(state)
+            if make_forms:
+                # Worker processes cannot start pools of their own
+                fr_experiment.make_stim_forms(processes=1)
+            status = 'prepared'
+        fr_experiment.journal.flush()
+    except Exception:
+        status = 'FAILED\n' + traceback.format_exc()
+    return subject, status, (time.time() - start) * 1000
+
+
+def prepare_subjects(subjects, config_file, sconfig_file, archive_dir, make_forms=False, processes=None):
+    """
+    Prepares several subjects in parallel
+    :return: list of (subject, status message, time taken in ms)
+    """
+    jobs = [(subject, config_file, sconfig_file, archive_dir, make_forms) for subject in subjects]
+    pool = multiprocessing.Pool(processes or min(len(jobs), multiprocessing.cpu_count()),
+                                maxtasksperchild=1)
+    try:
+        return pool.map(prepare_subject, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main(argv):
+    opts, subjects = getopt.getopt(argv, '', ['config=', 'sconfig=', 'archive=', 'forms', 'processes='])
+    opts = dict(opts)
+    if not subjects or '--sconfig' not in opts or '--archive' not in opts:
+        print __doc__
+        sys.exit(1)
+
+    results = prepare_subjects(subjects,
+                               opts.get('--config', 'config.py'),
+                               opts['--sconfig'],
+                               opts['--archive'],
+                               '--forms' in opts,
+                               int(opts['--processes']) if '--processes' in opts else None)
+    for subject, status, prepare_time in results:
+        print '%s: %s (%d ms)' % (subject, status, prepare_time)
+    if [status for _, status, _ in results if status.startswith('FAILED')]:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
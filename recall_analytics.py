@@ -0,0 +1,226 @@
+"""
+Recall analytics across the subjects of an experiment's archive.
+
+Every TEST_PROBE in each session.log is joined to the annotation of its
+recording (<trial>_<probe>.ann). A probe is correct if the expected word
+was annotated. Sessions are analysed in parallel, and each session's
+probes are cached along with the modification times of its files, so only
+new or changed sessions are analysed again.
+
+Archive layout:
+    <archive>/<subject>/session_<n>/session.log
+    <archive>/<subject>/session_<n>/<trial>_<probe>.ann
+
+Usage:
+    python recall_analytics.py --archive=<data dir> [--cache=<dir>] [--processes=N] [--json=<file>]
+"""
+import getopt
+import json
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+
+import log_columns
+
+CACHE_VERSION = 1
+# Columns of the per-probe rows
+PROBE_COLUMNS = ('trial', 'probepos', 'serialpos', 'direction', 'stim', 'correct', 'rt')
+
+
+def find_sessions(archive_dir):
+    """
+    :return: sorted list of (subject, session name, session directory)
+    """
+    sessions = []
+    for subject in sorted(os.listdir(archive_dir)):
+        subject_dir = os.path.join(archive_dir, subject)
+        if not os.path.isdir(subject_dir):
+            continue
+        for session in sorted(os.listdir(subject_dir)):
+            session_dir = os.path.join(subject_dir, session)
+            if session.startswith('session_') and os.path.exists(os.path.join(session_dir, 'session.log')):
+                sessions.append((subject, session, session_dir))
+    return sessions
+
+
+def session_mtimes(session_dir):
+    """
+    :return: {file name: modification time} of the files the analysis of a session reads
+    """
+    return dict((name, os.path.getmtime(os.path.join(session_dir, name)))
+                for name in os.listdir(session_dir)
+                if name == 'session.log' or name.endswith('.ann'))
+
+
+def read_annotation(path):
+    """
+    :param path: path to a .ann file
+    :return: list of (time in ms, word) for each annotated response
+    """
+    responses = []
+    for line in open(path):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        fields = line.split('\t')
+        if len(fields) >= 3:
+            responses.append((float(fields[0]), fields[2].strip().upper()))
+    return responses
+
+
+def analyse_session(args):
+    """
+    Joins a session's probes to their annotations. Runs in a worker process.
+    :param args: (session directory, path to write the session's columnar log to)
+    :return: list of probe rows (see PROBE_COLUMNS). Probes that are not annotated are left out.
+    """
+    session_dir, columns_path = args
+    column_file = log_columns.ColumnFile(log_columns.convert_session(session_dir, columns_path))
+    events = column_file['events']
+
+    # Stim status of each list, from its study pairs
+    study_rows = column_file.rows_of_type('events', 'STUDY_PAIR')
+    list_stim = dict(zip(events['trial'][study_rows].tolist(), events['stim'][study_rows].tolist()))
+
+    probe_rows = np.flatnonzero(column_file.rows_of_type('events', 'TEST_PROBE'))
+    rows = []
+    for row in probe_rows:
+        trial = int(events['trial'][row])
+        probepos = int(events['probepos'][row])
+        label = 'p' if trial < 0 else str(trial)
+        annotation = os.path.join(session_dir, '%s_%d.ann' % (label, probepos))
+        if not os.path.exists(annotation):
+            continue
+        expecting = (column_file.string(events['word2'][row]) or '').upper()
+        matches = [time for time, word in read_annotation(annotation) if word == expecting]
+        rows.append([trial, probepos, int(events['serialpos'][row]), int(events['direction'][row]),
+                     list_stim.get(trial, -1), int(bool(matches)), int(matches[0]) if matches else -1])
+    return rows
+
+
+class RecallAnalytics:
+    """
+    Probe-level recall data for every session of an archive, kept up to date
+    in a cache directory
+    """
+
+    def __init__(self, archive_dir, cache_dir):
+        self.archive_dir = archive_dir
+        self.cache_dir = cache_dir
+        self.n_analysed = 0
+        self.n_cached = 0
+
+    def _cache_path(self, subject, session, extension):
+        return os.path.join(self.cache_dir, subject, '%s.%s' % (session, extension))
+
+    def _cached(self, subject, session, mtimes):
+        path = self._cache_path(subject, session, 'json')
+        if not os.path.exists(path):
+            return None
+        try:
+            cached = json.load(open(path))
+        except ValueError:
+            # Unreadable, so analysed again
+            return None
+        if cached.get('version') != CACHE_VERSION or cached.get('mtimes') != mtimes:
+            return None
+        return cached['probes']
+
+    def update(self, processes=None):
+        """
+        Analyses the sessions that are new or changed since they were last cached
+        :param processes: (optional) number of worker processes. Defaults to the number of CPUs.
+        :return: list of (subject, session, probe rows) for every session in the archive
+        """
+        sessions = []
+        stale = []
+        for subject, session, session_dir in find_sessions(self.archive_dir):
+            mtimes = session_mtimes(session_dir)
+            probes = self._cached(subject, session, mtimes)
+            if probes is None:
+                stale.append((subject, session, session_dir, mtimes))
+            sessions.append((subject, session, probes))
+        self.n_cached = len(sessions) - len(stale)
+        self.n_analysed = len(stale)
+
+        jobs = []
+        for subject, session, session_dir, _ in stale:
+            if not os.path.exists(os.path.join(self.cache_dir, subject)):
+                os.makedirs(os.path.join(self.cache_dir, subject))
+            jobs.append((session_dir, self._cache_path(subject, session, 'palcol')))
+        if processes == 1 or len(jobs) <= 1:
+            results = map(analyse_session, jobs)
+        else:
+            pool = multiprocessing.Pool(processes or min(len(jobs), multiprocessing.cpu_count()))
+            try:
+                results = pool.map(analyse_session, jobs)
+            finally:
+                pool.close()
+                pool.join()
+
+        analysed = {}
+        for (subject, session, _, mtimes), probes in zip(stale, results):
+            path = self._cache_path(subject, session, 'json')
+            cache_file = open(path + '.tmp', 'w')
+            json.dump({'version': CACHE_VERSION, 'mtimes': mtimes, 'probes': probes}, cache_file)
+            cache_file.close()
+            os.rename(path + '.tmp', path)
+            analysed[(subject, session)] = probes
+        return [(subject, session, probes if probes is not None else analysed[(subject, session)])
+                for subject, session, probes in sessions]
+
+    @staticmethod
+    def summary(sessions):
+        """
+        :param sessions: list of (subject, session, probe rows), as returned by update()
+        :return: dictionary of recall rates (correct / annotated probes) over practice-free probes:
+                 overall, and by serial position, cue direction and stim
+        """
+        rows = [row for _, _, probes in sessions for row in probes if row[0] >= 0]
+        summary = {'subjects': len(set([subject for subject, _, probes in sessions if probes])),
+                   'sessions': len([probes for _, _, probes in sessions if probes]),
+                   'probes': len(rows)}
+        if not rows:
+            return summary
+        probes = np.array(rows, dtype=np.int32)
+        correct = probes[:, PROBE_COLUMNS.index('correct')]
+        summary['recall'] = float(correct.mean())
+
+        for column in ('serialpos', 'direction', 'stim'):
+            values = probes[:, PROBE_COLUMNS.index(column)]
+            keys = np.unique(values[values >= 0])
+            summary['recall_by_%s' % column] = dict((str(key), float(correct[values == key].mean()))
+                                                    for key in keys.tolist())
+        return summary
+
+
+def print_summary(summary):
+    print '%(subjects)d subjects, %(sessions)d sessions, %(probes)d annotated probes' % summary
+    if 'recall' not in summary:
+        return
+    print 'Recall: %.3f' % summary['recall']
+    for column in ('serialpos', 'direction', 'stim'):
+        by_value = summary['recall_by_%s' % column]
+        print 'By %s:\t%s' % (column, '\t'.join(['%s=%.3f' % (key, by_value[key])
+                                                  for key in sorted(by_value, key=int)]))
+
+
+def main(argv):
+    opts, _ = getopt.getopt(argv, '', ['archive=', 'cache=', 'processes=', 'json='])
+    opts = dict(opts)
+    if '--archive' not in opts:
+        print __doc__
+        sys.exit(1)
+    analytics = RecallAnalytics(opts['--archive'], opts.get('--cache', 'analytics_cache'))
+    sessions = analytics.update(int(opts['--processes']) if '--processes' in opts else None)
+    summary = RecallAnalytics.summary(sessions)
+    print '%d sessions analysed, %d from cache' % (analytics.n_analysed, analytics.n_cached)
+    print_summary(summary)
+    if '--json' in opts:
+        json.dump(summary, open(opts['--json'], 'w'), indent=2)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
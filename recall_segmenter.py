@@ -0,0 +1,96 @@
+import os
+import threading
+import wave
+import Queue
+
+from ramcontrol.control import logger
+
+
+class RecallSegmenter:
+    """
+    Cuts the continuous recording of a retrieval period into one .wav file
+    per probe, on a background thread.
+
+    The recording is read once, and each probe's frames are sliced out of it
+    and written to their own file. The sample offsets of each probe are made available through results()
+    so they can be logged between trials.
+
+    Ideally the samples would be kept in a preallocated ring buffer and each
+    probe cut as soon as its segment ends. PyEPL's CustomAudioTrack records
+    straight to a file and gives the task no access to the samples while it
+    records, so the segments can only be cut from that file once the
+    retrieval period has ended.
+    """
+
+    def __init__(self, on_cut=None):
+        """
+        :param on_cut: (optional) called from the background thread with the names of the
+                       recording and its segments once a recording has been cut
+        """
+        self.on_cut = on_cut
+        self._jobs = Queue.Queue()
+        self._results = Queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='RecallSegmenter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, directory, recording, start_time, segments):
+        """
+        Queues a continuous recording to be cut up
+        :param directory: directory containing the recording
+        :param recording: name of the recording, without .wav
+        :param start_time: time (ms) the recording started
+        :param segments: list of (name, start time, end time), times in ms, names without .wav
+        """
+        self._jobs.put((directory, recording, start_time, segments))
+
+    def flush(self):
+        """
+        Blocks until all queued recordings have been cut
+        """
+        self._jobs.join()
+
+    def results(self):
+        """
+        :return: list of (name, start sample, end sample, sample rate, end time in ms) for
+                 the segments written since the last call. Failed segments have
+                 start sample, end sample and rate of None.
+        """
+        results = []
+        while True:
+            try:
+                results.append(self._results.get_nowait())
+            except Queue.Empty:
+                return results
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            try:
+                self._cut(*job)
+                if self.on_cut:
+                    self.on_cut([job[1]] + [name for name, _, _ in job[3]])
+            except Exception as e:
+                logger.error('Could not cut recording %s: %s' % (job[1], e))
+                for name, _, segment_end in job[3]:
+                    self._results.put((name, None, None, None, segment_end))
+            finally:
+                self._jobs.task_done()
+
+    def _cut(self, directory, recording, start_time, segments):
+        source = wave.open(os.path.join(directory, recording + '.wav'), 'rb')
+        params = source.getparams()
+        rate = source.getframerate()
+        frame_size = source.getsampwidth() * source.getnchannels()
+        data = source.readframes(source.getnframes())
+        source.close()
+        n_frames = len(data) // frame_size
+
+        for name, segment_start, segment_end in segments:
+            start_sample = min(n_frames, max(0, int(round((segment_start - start_time) * rate / 1000.))))
+            end_sample = min(n_frames, max(start_sample, int(round((segment_end - start_time) * rate / 1000.))))
+            segment = wave.open(os.path.join(directory, name + '.wav'), 'wb')
+            segment.setparams(params)
+            segment.writeframes(data[start_sample * frame_size:end_sample * frame_size])
+            segment.close()
+            self._results.put((name, start_sample, end_sample, rate, segment_end))
@@ -0,0 +1,100 @@
+import atexit
+import json
+import os
+import threading
+import Queue
+
+from ramcontrol.control import logger
+
+
+class StateJournal:
+    """
+    Append-only record of progress through the experiment.
+
+    The full PyEPL state holds the plan for every session, so rewriting it
+    after every trial is wasteful. Instead, progress changes (trialNum,
+    practiceDone, ...) are appended to a journal by a background thread and
+    replayed over the saved state when it is restored. The journal is folded
+    back into the saved state by compact() at session boundaries.
+
+    Each record is tagged with the session it was made in, and only records
+    of the restored state's session are replayed. A journal left behind by a
+    crash during compact() therefore cannot undo the next session's state.
+    """
+
+    SESSION_KEY = '_session'
+
+
+    def __init__(self, path):
+        """
+        :param path: path to the journal file
+        """
+        self.path = path
+        self._queue = Queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='StateJournal')
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def record(self, session, **changes):
+        """
+        Queues state changes to be appended to the journal
+        :param session: number of the session the changes were made in
+        :param changes: state attributes and their new values
+        """
+        changes[self.SESSION_KEY] = session
+        self._queue.put(json.dumps(changes) + '\n')
+
+    def flush(self):
+        """
+        Blocks until all recorded changes have been written
+        """
+        self._queue.join()
+
+    def replay(self, state):
+        """
+        Applies the journaled changes to a restored state
+        :param state: state object from Experiment.restoreState()
+        :return: the updated state
+        """
+        self.flush()
+        if not os.path.exists(self.path):
+            return state
+        for line in open(self.path).readlines():
+            try:
+                changes = json.loads(line)
+            except ValueError:
+                # Partially written line from a crash
+                continue
+            if changes.pop(self.SESSION_KEY, state.sessionNum) != state.sessionNum:
+                # Left over from a session that has already been saved
+                continue
+            for key, value in changes.items():
+                setattr(state, str(key), value)
+        return state
+
+    def compact(self, exp, state, **kwargs):
+        """
+        Saves the full state and empties the journal
+        :param exp: Experiment object
+        :param state: state object to save
+        :param kwargs: additional changes to save with the state
+        """
+        self.flush()
+        exp.saveState(state, **kwargs)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _run(self):
+        while True:
+            line = self._queue.get()
+            try:
+                journal = open(self.path, 'a')
+                journal.write(line)
+                journal.flush()
+                os.fsync(journal.fileno())
+                journal.close()
+            except (IOError, OSError) as e:
+                logger.error('Could not write to state journal: %s' % e)
+            finally:
+                self._queue.task_done()
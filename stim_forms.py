@@ -0,0 +1,58 @@
+import hashlib
+import multiprocessing
+import os
+import time
+
+
+def build_form(job):
+    """
+    Builds a single stim form PDF from its LaTeX source. The PDF is not
+    rebuilt if it was last built from the same source.
+    :param job: (directory, form_name, source)
+    :return: (form_name, build time in ms, True if the existing PDF was reused)
+    """
+    directory, form_name, source = job
+    start = time.time()
+    digest = hashlib.sha1(source).hexdigest()
+    pdf_path = os.path.join(directory, form_name + '.pdf')
+    digest_path = os.path.join(directory, form_name + '.sha1')
+
+    if os.path.exists(pdf_path) and os.path.exists(digest_path) and \
+            open(digest_path).read().strip() == digest:
+        return form_name, (time.time() - start) * 1000, True
+
+    tex_file = open(os.path.join(directory, form_name + '.tex'), 'w')
+    tex_file.write(source)
+    tex_file.close()
+
+    # Make the dvi document
+    os.system('cd %s; latex %s.tex >> latexLog.txt' % (directory, form_name))
+    # Convert the dvi to pdf
+    os.system('cd %s; dvipdf %s.dvi >> latexLog.txt' % (directory, form_name))
+    # Clean up unneccesary files
+    os.system('cd %s; rm %s.dvi; rm %s.log; rm %s.aux' % (directory, form_name, form_name, form_name))
+
+    if os.path.exists(pdf_path):
+        digest_file = open(digest_path, 'w')
+        digest_file.write(digest)
+        digest_file.close()
+    return form_name, (time.time() - start) * 1000, False
+
+
+def build_forms(jobs, processes=None):
+    """
+    Builds stim form PDFs in parallel
+    :param jobs: list of (directory, form_name, source), one per form
+    :param processes: (optional) number of worker processes. Defaults to the number of CPUs.
+    :return: list of (form_name, build time in ms, reused) in the order of jobs
+    """
+    if not jobs:
+        return []
+    if processes == 1:
+        return map(build_form, jobs)
+    pool = multiprocessing.Pool(processes or min(len(jobs), multiprocessing.cpu_count()))
+    try:
+        return pool.map(build_form, jobs)
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,55 @@
+from pyepl import timing
+
+from ramcontrol.extendedPyepl import *
+
+
+class StimulusCache:
+    """
+    Holds the rendered pair and probe stimuli for a single list, so that no
+    text layout happens between clock.wait() and the screen update.
+    """
+
+    def __init__(self, size):
+        """
+        :param size: word font size (percentage of vertical screen)
+        """
+        self.size = size
+        self.pairs = []
+        self.probes = []
+        self.prebuild_time = None
+
+    @staticmethod
+    def _render(stimulus):
+        """
+        Forces the surface for a stimulus to be created now
+        :param stimulus: Text or CustomText object
+        :return: the same stimulus, loaded
+        """
+        stimulus.load()
+        return stimulus
+
+    def prebuild(self, pair_list, cue_dirs, rec_order):
+        """
+        Builds every pair and probe for the upcoming list
+        :param pair_list: pairs that will be presented, in presentation order
+        :param cue_dirs: cue direction for each probe
+        :param rec_order: serial position of the pair tested by each probe
+        :return: time taken to build the stimuli (ms)
+        """
+        start = timing.now()
+        self.evict()
+        self.pairs = [self._render(CustomText('\n\n'.join(pair), size=self.size))
+                      for pair in pair_list]
+        self.probes = [self._render(Text(pair_list[pair_i][cue_dir], size=self.size))
+                       for pair_i, cue_dir in zip(rec_order, cue_dirs)]
+        self.prebuild_time = timing.now() - start
+        return self.prebuild_time
+
+    def evict(self):
+        """
+        Releases the stimuli of the current list
+        """
+        for stimulus in self.pairs + self.probes:
+            stimulus.unload()
+        self.pairs = []
+        self.probes = []
@@ -0,0 +1,101 @@
+from array import array
+
+
+class TimingAudit:
+    """
+    Records the planned and actual onset of each timed event in a fixed-size
+    ring buffer, and reports the distribution of timing errors per event type.
+    """
+
+    EVENTS = ('ORIENT', 'STUDY_PAIR', 'PAIR_OFF', 'TEST_PROBE', 'PROBE_OFF', 'REC_START', 'REC_END')
+    PERCENTILES = (50, 90, 95, 99)
+    # Histogram bin edges (ms of error)
+    BIN_EDGES = (-10, -5, -2, -1, 0, 1, 2, 5, 10, 20, 50)
+
+    def __init__(self, capacity=4096):
+        """
+        :param capacity: number of events kept before the oldest are overwritten
+        """
+        self.capacity = capacity
+        self._codes = dict((event, i) for i, event in enumerate(self.EVENTS))
+        self._events = array('B', [0] * capacity)
+        self._planned = array('d', [0] * capacity)
+        self._actual = array('d', [0] * capacity)
+        self.n_recorded = 0
+
+    def record(self, event, planned, actual):
+        """
+        Records the timing of a single event
+        :param event: one of TimingAudit.EVENTS
+        :param planned: time (ms) the event was scheduled for
+        :param actual: time (ms) or PyEPL (time, latency) timestamp of the event
+        """
+        if isinstance(actual, tuple):
+            actual = actual[0]
+        i = self.n_recorded % self.capacity
+        self._events[i] = self._codes[event]
+        self._planned[i] = planned
+        self._actual[i] = actual
+        self.n_recorded += 1
+
+    def errors(self, event):
+        """
+        :param event: one of TimingAudit.EVENTS
+        :return: actual - planned (ms) for each retained event of that type
+        """
+        code = self._codes[event]
+        n = min(self.n_recorded, self.capacity)
+        return [self._actual[i] - self._planned[i] for i in range(n) if self._events[i] == code]
+
+    @staticmethod
+    def percentile(sorted_values, p):
+        """
+        :param sorted_values: non-empty sorted list
+        :param p: percentile (0-100)
+        :return: nearest-rank percentile of the values
+        """
+        rank = int(round(p / 100. * (len(sorted_values) - 1)))
+        return sorted_values[rank]
+
+    def histogram(self, errors):
+        """
+        :param errors: timing errors (ms)
+        :return: list of (label, count) for each bin of BIN_EDGES
+        """
+        edges = self.BIN_EDGES
+        labels = ['< %d' % edges[0]] + \
+                 ['[%d, %d)' % (edges[i], edges[i + 1]) for i in range(len(edges) - 1)] + \
+                 ['>= %d' % edges[-1]]
+        counts = [0] * len(labels)
+        for error in errors:
+            bin_i = 0
+            while bin_i < len(edges) and error >= edges[bin_i]:
+                bin_i += 1
+            counts[bin_i] += 1
+        return zip(labels, counts)
+
+    def report(self):
+        """
+        :return: text report of timing errors for each event type
+        """
+        lines = ['Timing error (actual - planned, ms) over %d events' % min(self.n_recorded, self.capacity)]
+        for event in self.EVENTS:
+            errors = sorted(self.errors(event))
+            lines.append('')
+            if not errors:
+                lines.append('%s: no events' % event)
+                continue
+            lines.append('%s: n=%d mean=%.2f min=%.1f max=%.1f' %
+                         (event, len(errors), sum(errors) / len(errors), errors[0], errors[-1]))
+            lines.append('\t'.join(['p%d=%.1f' % (p, self.percentile(errors, p)) for p in self.PERCENTILES]))
+            for label, count in self.histogram(errors):
+                lines.append('\t%s\t%d' % (label, count))
+        return '\n'.join(lines) + '\n'
+
+    def write_report(self, report_file):
+        """
+        Writes the report and closes the file
+        :param report_file: open file object
+        """
+        report_file.write(self.report())
+        report_file.close()
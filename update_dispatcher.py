@@ -0,0 +1,92 @@
+class UpdateDispatcher:
+    """
+    A single screen update callback, registered with the video track once per
+    session, that maps each screen update to the STATE message of whatever
+    stimulus is being presented.
+
+    The messages for each kind of stimulus are looked up once, when the
+    dispatcher is built: presenting a stimulus only selects a row of the
+    table, and each screen update sends the message at its position in that
+    row. Updates beyond the end of the row, or while no stimulus is being
+    presented, send nothing.
+    """
+
+    # Stimulus kind -> STATE messages sent on its first, second, ... screen update
+    TABLE = {'WORD': (('WORD', True), ('WORD', False)),
+             'ORIENT': (('ORIENT', True), ('ORIENT', False))}
+
+    def __init__(self, send_state, state_list):
+        """
+        :param send_state: function(state, value) that sends a STATE message
+        :param state_list: states the control PC was configured with
+        """
+        for kind, messages in self.TABLE.items():
+            for state, _ in messages:
+                if state not in state_list:
+                    raise Exception('Improper state %s not in list of states' % state)
+        self._send_state = send_state
+        self._messages = ()
+        self._stimulus = None
+        self._n_updates = 0
+        # Stimulus -> number of screen updates while it was presented
+        self.update_counts = {}
+        self.expected_counts = {}
+        self.idle_updates = 0
+
+    def __call__(self, *_):
+        n = self._n_updates
+        self._n_updates = n + 1
+        if n < len(self._messages):
+            self._send_state(*self._messages[n])
+        elif self._stimulus is None:
+            self.idle_updates += 1
+
+    def present(self, kind, stimulus):
+        """
+        Directs the following screen updates to a stimulus
+        :param kind: key of TABLE
+        :param stimulus: key the stimulus' updates are counted under, e.g. ('TEST_PROBE', trial, probe)
+        """
+        self._messages = self.TABLE[kind]
+        self._stimulus = stimulus
+        self._n_updates = 0
+
+    def done(self):
+        """
+        Ends the current stimulus
+        :return: number of screen updates it produced
+        """
+        n = self._n_updates
+        self.update_counts[self._stimulus] = n
+        self.expected_counts[self._stimulus] = len(self._messages)
+        self._messages = ()
+        self._stimulus = None
+        self._n_updates = 0
+        return n
+
+    def unexpected(self):
+        """
+        :return: sorted list of (stimulus, updates, expected updates) for stimuli whose number of
+                 screen updates did not match their messages
+        """
+        return sorted([(stimulus, n, self.expected_counts[stimulus])
+                       for stimulus, n in self.update_counts.items() if n != self.expected_counts[stimulus]])
+
+    def report(self):
+        """
+        :return: text report of screen updates per stimulus
+        """
+        unexpected = self.unexpected()
+        lines = ['%d stimuli, %d screen updates, %d with an unexpected number of updates, %d updates between stimuli' %
+                 (len(self.update_counts), sum(self.update_counts.values()), len(unexpected), self.idle_updates)]
+        lines.extend(['%s\t%d\texpected %d' % (' '.join([str(part) for part in stimulus]), n, expected)
+                      for stimulus, n, expected in unexpected])
+        return '\n'.join(lines) + '\n'
+
+    def write_report(self, report_file):
+        """
+        Writes the report and closes the file
+        :param report_file: open file object
+        """
+        report_file.write(self.report())
+        report_file.close()
@@ -0,0 +1,282 @@
+"""
+Detects the onset of vocalization in probe recordings.
+
+Each recording is split into short overlapping windows. A window is voiced
+if its RMS level is well above the noise floor; the onset is the first run
+of voiced windows long enough to be speech, moved to the largest spectral
+flux (rise in spectral magnitude) around the start of the run.
+
+The noise floor is measured where the subject should be silent: in the
+continuous retrieval recording, the pre-cue window before each probe;
+otherwise a recording of silence calibrated once per session, after the mic
+test. Only when neither is available is it estimated from the recording
+itself, which fails if the subject speaks through most of it.
+
+Detection runs on finished recordings, after the fact. It does not follow
+the audio as it is recorded.
+
+To test the detector on recordings:
+    python vocal_onset.py [--floor=<silent recording>.wav] <session dir>/*.wav
+"""
+import getopt
+import os
+import sys
+import threading
+import time
+import wave
+import Queue
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+from ramcontrol.control import logger
+
+WINDOW_MS = 20
+HOP_MS = 10
+# Voiced windows are at least this far above the noise floor ...
+THRESHOLD_DB = 15.
+# ... and above this absolute level (dB relative to full scale)
+MIN_LEVEL_DB = -55.
+# Shortest run of voiced windows counted as speech
+MIN_SPEECH_MS = 60
+# Windows either side of the start of speech searched for the flux peak
+FLUX_SEARCH_MS = 50
+
+
+def read_wav(path):
+    """
+    :return: (mono samples scaled to [-1, 1), sample rate)
+    """
+    recording = wave.open(path, 'rb')
+    width, n_channels, rate = recording.getsampwidth(), recording.getnchannels(), recording.getframerate()
+    data = recording.readframes(recording.getnframes())
+    recording.close()
+    if width == 1:
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128) / 128.
+    else:
+        dtype = {2: '<i2', 4: '<i4'}[width]
+        samples = np.frombuffer(data, dtype=dtype).astype(np.float32) / 2 ** (8 * width - 1)
+    if n_channels > 1:
+        samples = samples[:len(samples) // n_channels * n_channels].reshape(-1, n_channels).mean(axis=1)
+    return samples, rate
+
+
+def _windows(samples, window, hop):
+    n_windows = 1 + (len(samples) - window) // hop
+    stride = samples.strides[0]
+    return as_strided(samples, shape=(n_windows, window), strides=(hop * stride, stride))
+
+
+def _levels(samples, rate):
+    """
+    :return: (windows of the samples, RMS level of each window in dB), or None if there are too few samples
+    """
+    window = int(rate * WINDOW_MS / 1000)
+    hop = int(rate * HOP_MS / 1000)
+    if len(samples) < window * 2:
+        return None
+    frames = _windows(np.ascontiguousarray(samples, dtype=np.float32), window, hop)
+    return frames, 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-12)
+
+
+def measure_noise_floor(samples, rate):
+    """
+    :param samples: mono samples of a recording in which the subject is silent
+    :param rate: sample rate (Hz)
+    :return: median window level (dB), or None if there are too few samples
+    """
+    levels = _levels(samples, rate)
+    if levels is None:
+        return None
+    return float(np.median(levels[1]))
+
+
+def detect_onset(samples, rate, noise_floor=None):
+    """
+    :param samples: mono samples scaled to [-1, 1)
+    :param rate: sample rate (Hz)
+    :param noise_floor: (optional) level (dB) of silence, from measure_noise_floor(). If not given,
+                        it is estimated from the quietest windows of the samples themselves.
+    :return: onset of vocalization (ms from the start of the samples), or None if there is none
+    """
+    levels = _levels(samples, rate)
+    if levels is None:
+        return None
+    frames, level = levels
+    window = frames.shape[1]
+
+    if noise_floor is None:
+        noise_floor = np.percentile(level, 10)
+    voiced = (level > noise_floor + THRESHOLD_DB) & (level > MIN_LEVEL_DB)
+
+    # Start of the first run of voiced windows that is long enough
+    min_run = max(1, int(MIN_SPEECH_MS / HOP_MS))
+    runs = np.convolve(voiced.astype(np.int32), np.ones(min_run, dtype=np.int32), mode='valid')
+    starts = np.flatnonzero(runs == min_run)
+    if not len(starts):
+        return None
+    speech_start = starts[0]
+
+    search = int(FLUX_SEARCH_MS / HOP_MS)
+    first = max(1, speech_start - search)
+    last = min(len(frames), speech_start + search + 1)
+    spectra = np.abs(np.fft.rfft(frames[first - 1:last] * np.hanning(window), axis=1))
+    flux = np.maximum(spectra[1:] - spectra[:-1], 0).sum(axis=1)
+    onset_window = first + int(np.argmax(flux)) if len(flux) else speech_start
+    return onset_window * HOP_MS
+
+
+class OnsetDetector:
+    """
+    Detects vocalization onsets in finished recordings on a background thread.
+    Results are collected with results(), which is cheap enough to call
+    between probes.
+
+    Per-probe recordings are measured against the floor set by calibrate().
+    Continuous retrieval recordings are analysed in place, each probe against
+    the floor of its own pre-cue window.
+    """
+
+    def __init__(self, directory, on_done=None):
+        """
+        :param directory: directory the recordings are written to
+        :param on_done: (optional) called from the background thread with the name
+                        of each recording once it has been analysed
+        """
+        self.directory = directory
+        self.on_done = on_done
+        # Level (dB) of silence, set by calibrate()
+        self.noise_floor = None
+        self.analysis_ms = []
+        self.drain_ms = []
+        self.n_onsets = 0
+        self.n_late = 0
+        self._jobs = Queue.Queue()
+        self._results = Queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='OnsetDetector')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def calibrate(self, name):
+        """
+        Measures the noise floor used for per-probe recordings. Reads the recording on the calling thread.
+        :param name: name of a recording in which the subject is silent, without .wav
+        :return: the noise floor (dB), or None if the recording is too short
+        """
+        self.noise_floor = measure_noise_floor(*read_wav(os.path.join(self.directory, name + '.wav')))
+        return self.noise_floor
+
+    def submit(self, names):
+        """
+        Queues recordings for onset detection
+        :param names: names of the recordings, without .wav
+        """
+        for name in names:
+            self._jobs.put((name, None))
+
+    def submit_continuous(self, recording, start_time, segments):
+        """
+        Queues a continuous retrieval recording for onset detection in each of its probes.
+        on_done is called with the name of the recording, not of its segments.
+        :param recording: name of the recording, without .wav
+        :param start_time: time (ms) the recording started
+        :param segments: list of (name, pre-cue start, probe onset, end), times in ms.
+                         Onsets are detected between probe onset and end, against the
+                         noise floor from pre-cue start to probe onset.
+        """
+        self._jobs.put((recording, (start_time, segments)))
+
+    def flush(self):
+        """
+        Blocks until all queued recordings have been analysed
+        """
+        self._jobs.join()
+
+    def results(self, late=False):
+        """
+        :param late: True if the results are being collected after their list has ended
+        :return: list of (name, onset in ms from the start of the recording or segment, or None)
+                 for the recordings and segments analysed since the last call
+        """
+        start = time.time()
+        results = []
+        while True:
+            try:
+                results.append(self._results.get_nowait())
+            except Queue.Empty:
+                break
+        if late:
+            self.n_late += len(results)
+        self.drain_ms.append((time.time() - start) * 1000)
+        return results
+
+    def _detect(self, name, samples, rate, noise_floor):
+        start = time.time()
+        onset = detect_onset(samples, rate, noise_floor)
+        self.analysis_ms.append((time.time() - start) * 1000)
+        if onset is not None:
+            self.n_onsets += 1
+        self._results.put((name, onset))
+
+    def _detect_segments(self, samples, rate, start_time, segments):
+        def sample(t):
+            return min(len(samples), max(0, int(round((t - start_time) * rate / 1000.))))
+
+        for name, pre_cue_start, segment_start, segment_end in segments:
+            noise_floor = measure_noise_floor(samples[sample(pre_cue_start):sample(segment_start)], rate)
+            segment = samples[sample(segment_start):sample(segment_end)]
+            self._detect(name, segment, rate, self.noise_floor if noise_floor is None else noise_floor)
+
+    def _run(self):
+        while True:
+            name, continuous = self._jobs.get()
+            try:
+                samples, rate = read_wav(os.path.join(self.directory, name + '.wav'))
+                if continuous:
+                    self._detect_segments(samples, rate, *continuous)
+                else:
+                    self._detect(name, samples, rate, self.noise_floor)
+            except Exception as e:
+                logger.error('Could not detect onset in %s: %s' % (name, e))
+                for segment in (continuous[1] if continuous else [(name,)]):
+                    self._results.put((segment[0], None))
+            finally:
+                if self.on_done:
+                    self.on_done([name])
+                self._jobs.task_done()
+
+    def report(self, min_probe_interval=None):
+        """
+        :param min_probe_interval: (optional) shortest time (ms) from the end of a recording to the next probe
+        :return: text report of the time spent on onset detection
+        """
+        lines = ['Vocal onset detection: %d recordings, %d onsets found' % (len(self.analysis_ms), self.n_onsets)]
+        for label, values in (('Analysis (background thread)', self.analysis_ms),
+                              ('Collecting results (presentation thread)', self.drain_ms)):
+            if values:
+                lines.append('%s: mean=%.2f max=%.2f total=%.1f ms over %d calls' %
+                             (label, sum(values) / len(values), max(values), sum(values), len(values)))
+        if min_probe_interval is not None and self.analysis_ms:
+            over = len([ms for ms in self.analysis_ms if ms >= min_probe_interval])
+            lines.append('Analyses longer than the %d ms before the next probe: %d' % (min_probe_interval, over))
+        lines.append('Results collected after their list ended: %d' % self.n_late)
+        return '\n'.join(lines) + '\n'
+
+    def write_report(self, report_file, min_probe_interval=None):
+        """
+        Writes the report and closes the file
+        :param report_file: open file object
+        """
+        report_file.write(self.report(min_probe_interval))
+        report_file.close()
+
+
+if __name__ == '__main__':
+    opts, paths = getopt.getopt(sys.argv[1:], '', ['floor='])
+    if not paths:
+        print __doc__
+        sys.exit(1)
+    floor = measure_noise_floor(*read_wav(dict(opts)['--floor'])) if '--floor' in dict(opts) else None
+    for path in paths:
+        onset = detect_onset(*read_wav(path), noise_floor=floor)
+        print '%s\t%s' % (path, 'none' if onset is None else '%d ms' % onset)
@@ -0,0 +1,70 @@
+import codecs
+import random
+from array import array
+
+
+class WordPool:
+    """
+    Words from a word pool file, stored as one contiguous utf-8 buffer with
+    an array of offsets, and a dictionary index from word to position.
+    Words are decoded when they are looked up.
+
+    Pools are parsed once per process; use WordPool.load() to get one.
+    """
+
+    _loaded = {}
+
+    def __init__(self, words):
+        """
+        :param words: sequence of unicode words
+        """
+        encoded = [word.encode('utf-8') for word in words]
+        self._offsets = array('i', [0])
+        for word in encoded:
+            self._offsets.append(self._offsets[-1] + len(word))
+        self._data = ''.join(encoded)
+        self.index = dict((word, i) for i, word in enumerate(words))
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Gets the pool for a word pool file, parsing it on first use
+        :param filename: path to a utf-8 word pool file, one word per line
+        :return: WordPool object
+        """
+        if filename not in cls._loaded:
+            lines = [line.strip() for line in codecs.open(filename, 'r', 'utf-8').readlines()]
+            cls._loaded[filename] = cls([line for line in lines if line])
+        return cls._loaded[filename]
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        return self._data[self._offsets[i]:self._offsets[i + 1]].decode('utf-8')
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def __contains__(self, word):
+        return word in self.index
+
+    def find(self, word):
+        """
+        :param word: word to look up
+        :return: position of the word in the pool
+        """
+        return self.index[word]
+
+    def shuffled_order(self):
+        """
+        Shuffles the positions of the words in the pool. Makes the same calls
+        to the random number generator as shuffling the words themselves.
+        :return: list of positions in random order
+        """
+        order = range(len(self))
+        random.shuffle(order)
+        return order
@@ -0,0 +1,198 @@
+"""
+Pairwise similarity between the words of a word pool, and a list generator
+that keeps similar words out of the same list.
+
+Similarity (0-100) is the largest of:
+    - shared onset: length of the common prefix (up to 3 letters) / 3
+    - shared rhyme: length of the common suffix (up to 3 letters) / 3
+    - orthographic overlap: Dice coefficient of the words' letter bigrams
+Words are compared without case or accents.
+
+To precompute the cached similarity matrices:
+    python word_similarity.py txt_EN/RAM_wordpool.txt txt_SP/RAM_wordpool.txt
+"""
+import hashlib
+import os
+import random
+import sys
+import unicodedata
+
+import numpy as np
+
+from word_pool import WordPool
+
+CACHE_VERSION = 1
+AFFIX_LENGTH = 3
+
+
+def _normalize(word):
+    folded = unicodedata.normalize('NFKD', word)
+    return u''.join([c for c in folded if not unicodedata.combining(c)]).lower()
+
+
+def _shared_affix_length(affixes):
+    """
+    :param affixes: for k = 1..AFFIX_LENGTH, a list of each word's k letter prefix (or suffix)
+    :return: (n_words, n_words) number of leading (or trailing) letters two words share
+    """
+    shared = 0
+    for affix in affixes:
+        codes = np.unique(affix, return_inverse=True)[1]
+        shared = shared + (codes[:, None] == codes[None, :])
+    return shared
+
+
+class SimilarityIndex:
+    """
+    Similarity matrix over the words of a word pool
+    """
+
+    def __init__(self, words, matrix):
+        """
+        :param words: sequence of words
+        :param matrix: (n_words, n_words) uint8 similarity, 0-100
+        """
+        self.words = words
+        self.matrix = matrix
+
+    @classmethod
+    def build(cls, words):
+        """
+        Computes the similarity matrix for a sequence of words
+        """
+        normalized = [_normalize(word) for word in words]
+
+        onsets = [[word[:k] if len(word) >= k else word + '\0' for word in normalized]
+                  for k in range(1, AFFIX_LENGTH + 1)]
+        rhymes = [[word[-k:] if len(word) >= k else '\0' + word for word in normalized]
+                  for k in range(1, AFFIX_LENGTH + 1)]
+        affix_similarity = np.maximum(_shared_affix_length(onsets), _shared_affix_length(rhymes)) / \
+            float(AFFIX_LENGTH)
+
+        bigrams = [set([padded[i:i + 2] for i in range(len(padded) - 1)])
+                   for padded in ['^%s$' % word for word in normalized]]
+        vocabulary = dict((bigram, i) for i, bigram in enumerate(set().union(*bigrams)))
+        counts = np.zeros((len(words), len(vocabulary)), dtype=np.float32)
+        for word_i, word_bigrams in enumerate(bigrams):
+            counts[word_i, [vocabulary[bigram] for bigram in word_bigrams]] = 1
+        n_bigrams = counts.sum(axis=1)
+        dice = 2 * counts.dot(counts.T) / (n_bigrams[:, None] + n_bigrams[None, :])
+
+        matrix = np.round(100 * np.maximum(affix_similarity, dice)).astype(np.uint8)
+        np.fill_diagonal(matrix, 0)
+        return cls(words, matrix)
+
+    @classmethod
+    def load(cls, pool_file, cache_dir):
+        """
+        Gets the similarity index for a word pool file, from the cache if possible
+        :param pool_file: path to the word pool file
+        :param cache_dir: directory to keep cached matrices in
+        :return: SimilarityIndex object
+        """
+        words = list(WordPool.load(pool_file))
+        key = hashlib.sha1('%d\n%s' % (CACHE_VERSION, u'\n'.join(words).encode('utf-8'))).hexdigest()
+        cache_file = os.path.join(cache_dir, 'similarity_%s.npy' % key)
+        if os.path.exists(cache_file):
+            return cls(words, np.load(cache_file))
+        index = cls.build(words)
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        np.save(cache_file, index.matrix)
+        return index
+
+
+class ConstraintError(Exception):
+    pass
+
+
+class ConstrainedListSampler:
+    """
+    Splits shuffled word pool positions into lists such that no two words in
+    the same list have a similarity at or above a limit.
+
+    Words are first placed greedily; lists with conflicts are then repaired by
+    swapping words between lists, up to a fixed number of swaps.
+    """
+
+    def __init__(self, index, max_similarity, max_swaps=2000, rng=random):
+        """
+        :param index: SimilarityIndex of the word pool
+        :param max_similarity: words with at least this similarity (0-100) may not share a list
+        :param max_swaps: number of repair swaps to try before giving up
+        :param rng: (optional) random.Random instance used for repairs. Defaults to the random module.
+        """
+        self.conflicts = [set(np.flatnonzero(row).tolist()) for row in index.matrix >= max_similarity]
+        self.max_swaps = max_swaps
+        self.rng = rng
+
+    def _fits(self, word, members, ignore=None):
+        conflicts = self.conflicts[word].intersection(members)
+        return not conflicts or conflicts == set([ignore])
+
+    def _has_conflict(self, word, members):
+        return not self.conflicts[word].isdisjoint(members)
+
+    def sample(self, order, n_lists, list_length):
+        """
+        :param order: shuffled word pool positions
+        :param n_lists: number of lists to make
+        :param list_length: number of words in each list
+        :return: n_lists lists of list_length word pool positions
+        """
+        if n_lists * list_length > len(order):
+            raise ConstraintError('Not enough words for %d lists of %d' % (n_lists, list_length))
+        lists = [[] for _ in range(n_lists)]
+
+        # Greedy placement, starting at a different list for each word
+        for word_i, word in enumerate(order[:n_lists * list_length]):
+            open_lists = [lists[(word_i + i) % n_lists] for i in range(n_lists)
+                          if len(lists[(word_i + i) % n_lists]) < list_length]
+            fitting = [members for members in open_lists if self._fits(word, members)]
+            (fitting or open_lists)[0].append(word)
+
+        # Repair lists with conflicts by swapping words between lists
+        for _ in range(self.max_swaps):
+            conflicted = [(list_i, word) for list_i, members in enumerate(lists)
+                          for word in members if self._has_conflict(word, members)]
+            if not conflicted:
+                return lists
+            list_i, word = self.rng.choice(conflicted)
+            if not self._swap_out(lists, list_i, word):
+                # No clean swap, move the conflict somewhere else
+                other_i = self.rng.choice([i for i in range(n_lists) if i != list_i])
+                other_word = self.rng.choice(lists[other_i])
+                self._swap(lists, list_i, word, other_i, other_word)
+        raise ConstraintError('Could not satisfy similarity limit within %d swaps' % self.max_swaps)
+
+    def _swap_out(self, lists, list_i, word):
+        """
+        Swaps a word for one in another list, if both then fit in their new lists
+        :return: True if a swap was made
+        """
+        list_order = range(len(lists))
+        self.rng.shuffle(list_order)
+        for other_i in list_order:
+            if other_i == list_i:
+                continue
+            for other_word in lists[other_i]:
+                if self._fits(word, lists[other_i], ignore=other_word) and \
+                        self._fits(other_word, lists[list_i], ignore=word):
+                    self._swap(lists, list_i, word, other_i, other_word)
+                    return True
+        return False
+
+    @staticmethod
+    def _swap(lists, list_i, word, other_i, other_word):
+        lists[list_i][lists[list_i].index(word)] = other_word
+        lists[other_i][lists[other_i].index(other_word)] = word
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print __doc__
+        sys.exit(1)
+    for pool_file in sys.argv[1:]:
+        index = SimilarityIndex.load(pool_file, 'similarity_cache')
+        print '%s: %d words, %d similar pairs at >= 50' % \
+              (pool_file, len(index.words), (index.matrix >= 50).sum() / 2)